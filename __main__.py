@@ -1,9 +1,126 @@
+import argparse
 import sys
-from PySide2.QtWidgets import QApplication
-import gui
 
 
-app = QApplication()
-window = gui.MainWindow()
-window.show()
-sys.exit(app.exec_())
+def run_gui(args):
+	from PySide2.QtWidgets import QApplication
+	import gui
+
+	app = QApplication(sys.argv[:1])
+	window = gui.MainWindow()
+	window.show()
+	if args.dataset:
+		window.init_dataset(args.dataset)
+	return app.exec_()
+
+
+def run_export(args):
+	import cache
+	import export
+
+	snapshots = cache.SnapshotCache()
+	dataset = cache.DatasetCache(snapshots=snapshots).load(args.dataset)
+	export.export(
+		dataset, args.output, args.format,
+		include_results=not args.no_results, workers=args.workers
+	)
+	# A snapshot of the dataset may still be being written
+	snapshots.wait()
+	return 0
+
+
+def run_import(args):
+	import cache
+	import compression
+	import importer
+	import sharding
+
+	snapshots = cache.SnapshotCache()
+	dataset = cache.DatasetCache(snapshots=snapshots).load(args.dataset)
+	names = importer.import_csv(dataset, args.csv, sheet_column=args.sheet_column, group_by=args.group_by)
+	if sharding.is_sharded(dataset):
+		# Only the manifest and the shards that changed are written; all of them when writing elsewhere
+		sharding.save(dataset, args.output or args.dataset)
+	else:
+		compression.save(dataset, args.output or args.dataset)
+	print(f'Imported {len(names)} sheets')
+	snapshots.wait()
+	return 0
+
+
+def run_shard(args):
+	import cache
+	import sharding
+
+	dataset = cache.DatasetCache().load(args.dataset)
+	sharding.split(dataset, args.manifest, args.by, args.size)
+	return 0
+
+
+def run_service(args):
+	import asyncio
+	import service
+
+	try:
+		asyncio.run(service.serve(args.host, args.port, args.socket, args.datasets, args.workers))
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='DatasheetCalculator', description='Runs the GUI if no command is given.')
+	parser.add_argument(
+		'--trace', metavar='FILE',
+		help='record where time is spent and write it to FILE (Chrome trace format) at exit'
+	)
+	subparsers = parser.add_subparsers(dest='command')
+
+	gui_parser = subparsers.add_parser('gui', help='open the GUI (the default)')
+	gui_parser.add_argument('dataset', nargs='?', help='dataset to open')
+	gui_parser.set_defaults(func=run_gui)
+
+	export_parser = subparsers.add_parser('export', help='write one row per sheet with its values and formula results')
+	export_parser.add_argument('dataset')
+	export_parser.add_argument('output', help='.csv or .jsonl file')
+	export_parser.add_argument('--format', choices=('csv', 'jsonl'), help='output format (default: from the file extension)')
+	export_parser.add_argument('--workers', type=int, default=0, help='evaluate formulas in this many processes')
+	export_parser.add_argument('--no-results', action='store_true', help="don't evaluate formulas")
+	export_parser.set_defaults(func=run_export)
+
+	import_parser = subparsers.add_parser('import', help='add one sheet per CSV row, with "group/value" columns')
+	import_parser.add_argument('dataset')
+	import_parser.add_argument('csv')
+	import_parser.add_argument('-o', '--output', help='write the dataset here instead of overwriting it')
+	import_parser.add_argument('--sheet-column', default='sheet', help='column with sheet names (default: sheet)')
+	import_parser.add_argument('--group-by', help='merge rows with the same value in this column into one sheet')
+	import_parser.set_defaults(func=run_import)
+
+	shard_parser = subparsers.add_parser('shard', help='write a copy of a dataset as a manifest and shard files')
+	shard_parser.add_argument('dataset')
+	shard_parser.add_argument('manifest', help='manifest file; shards are written to a directory next to it')
+	shard_parser.add_argument('--by', choices=('count', 'year', 'month'), default='count', help='how to group sheets into shards')
+	shard_parser.add_argument('--size', type=int, default=100, help='sheets per shard when sharding by count')
+	shard_parser.set_defaults(func=run_shard)
+
+	serve_parser = subparsers.add_parser('serve', help='answer JSON-RPC requests about datasets (see service.py)')
+	serve_parser.add_argument('datasets', nargs='*', help='datasets to load on startup')
+	serve_parser.add_argument('--host', default='127.0.0.1')
+	serve_parser.add_argument('--port', type=int, default=8765)
+	serve_parser.add_argument('--socket', help='listen on this Unix socket instead of TCP')
+	serve_parser.add_argument('--workers', type=int, help='threads evaluating formulas')
+	serve_parser.set_defaults(func=run_service)
+
+	if argv is None:
+		argv = sys.argv[1:]
+	args = parser.parse_args(argv)
+	if args.command is None:
+		args = parser.parse_args([*argv, 'gui'])
+	if args.trace:
+		import tracing
+		tracing.start(args.trace)
+	return args.func(args)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
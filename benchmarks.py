@@ -0,0 +1,463 @@
+"""
+Performance comparisons on large synthetic datasets.
+
+Run ``python benchmarks.py`` to run every benchmark, or pass benchmark names
+(e.g. ``python benchmarks.py value_types``) to only run some of them.
+"""
+import copy
+import datetime
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import cache
+import compression
+import datasets
+import sharding
+import sweep
+
+
+EXAMPLE_DATASET = Path(__file__).parent / 'ExampleDatasets' / 'RuralCarrier.json'
+WEEKDAYS = ('Saturday', 'Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday')
+
+
+def make_synthetic_data(sheet_count, seed=0):
+	"""
+	Returns raw dataset data (as it would be loaded from JSON) with the format, special sheet and formulas
+	of the example dataset and `sheet_count` randomly filled pay periods.
+	"""
+	rng = random.Random(seed)
+	with open(EXAMPLE_DATASET) as f:
+		data = json.load(f)
+	data['format']['Period'] = {'Start': 'date', 'Days worked': 'calcdelta_d'}
+	special = data['sheets']['__special__']
+	data['sheets'] = {'__special__': special}
+	first_day = datetime.date(2000, 1, 1)
+	for i in range(sheet_count):
+		hours = []
+		for _ in WEEKDAYS:
+			start = rng.randrange(6, 10)
+			hours.append([f'{start:02}:{rng.randrange(60):02}:00', f'{start + rng.randrange(4, 10):02}:00:00'])
+		start_day = first_day + datetime.timedelta(days=7 * i)
+		data['sheets'][f'Pay period {i + 1}'] = [
+			hours,
+			[rng.choice(('', 'R1', 'R2', 'R3', 'r4', 'R10')) for _ in WEEKDAYS],
+			[rng.randrange(200) for _ in WEEKDAYS],
+			[f'{rng.randrange(2)}h{rng.randrange(60)}m' for _ in WEEKDAYS],
+			[
+				start_day.isoformat(),
+				[start_day.isoformat(), (start_day + datetime.timedelta(days=rng.randrange(7))).isoformat()]
+			]
+		]
+	return data
+
+
+def timed(func, *args, repeat=3, **kwargs):
+	"""Returns the best wall-clock time of `repeat` calls to `func`, in seconds, and the last result."""
+	best = None
+	result = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = func(*args, **kwargs)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best, result
+
+
+def allocated(func, *args, **kwargs):
+	"""Returns the number of bytes still allocated by the result of `func`, and the result itself."""
+	gc.collect()
+	tracemalloc.start()
+	try:
+		before = tracemalloc.get_traced_memory()[0]
+		result = func(*args, **kwargs)
+		gc.collect()
+		after = tracemalloc.get_traced_memory()[0]
+	finally:
+		tracemalloc.stop()
+	return after - before, result
+
+
+def report(title, rows):
+	print(title)
+	width = max(len(label) for label, _ in rows)
+	for label, value in rows:
+		print(f'  {label:<{width}}  {value}')
+	print()
+
+
+class _DictTimedelta(datetime.timedelta):
+	# The value types as they were before they had __slots__, for comparison
+	def __new__(cls, *args, fmt, **kwargs):
+		self = super().__new__(cls, *args, **kwargs)
+		self.fmt = fmt
+		return self
+
+
+class _DictPrice(float):
+	...
+
+
+class _DictCalcdelta:
+	def __init__(self, start, end):
+		self.start = start
+		self.end = end
+		self.data_type = type(start)
+
+	@property
+	def delta(self):
+		return datasets.calculate_delta(self.start, self.end)
+
+
+def bench_value_types(sheet_count=5000):
+	dataset = datasets.Dataset(make_synthetic_data(sheet_count))
+	values = [v for sheet in dataset.sheets.values() for group in sheet.values() for v in group.values()]
+	pairs = [(v.start, v.end) for v in values if isinstance(v, datasets.Calcdelta)]
+	timedeltas = [v for v in values if isinstance(v, datasets.Timedelta)]
+	prices = [float(i) for i in range(len(values))]
+	rows = []
+	for label, make in (
+		('Calcdelta', lambda cls: [cls(s, e) for s, e in pairs]),
+		('Timedelta', lambda cls: [cls(fmt=t.fmt, seconds=t.total_seconds()) for t in timedeltas]),
+		('Price', lambda cls: [cls(p) for p in prices])
+	):
+		old_cls, new_cls = {
+			'Calcdelta': (_DictCalcdelta, datasets.Calcdelta),
+			'Timedelta': (_DictTimedelta, datasets.Timedelta),
+			'Price': (_DictPrice, datasets.Price)
+		}[label]
+		old_size, _ = allocated(make, old_cls)
+		new_size, _ = allocated(make, new_cls)
+		count = len(make(new_cls))
+		rows.append((
+			f'{label} memory ({count} values)',
+			f'{old_size / count:.0f} -> {new_size / count:.0f} bytes per value'
+		))
+
+	formula = "round(sum(v.delta.total_seconds() for v in current['Hours'].values()) / 3600, 2)"
+	old_sheets = [
+		{'Hours': {day: _DictCalcdelta(v.start, v.end) for day, v in sheet['Hours'].items()}}
+		for sheet in dataset.sheets.values()
+	]
+	new_sheets = [{'Hours': dict(sheet['Hours'])} for sheet in dataset.sheets.values()]
+	code = compile(formula, '<formula>', 'eval')
+
+	def evaluate(sheets, passes=5):
+		for _ in range(passes):
+			for sheet in sheets:
+				eval(code, {'current': sheet})
+
+	old_time, _ = timed(evaluate, old_sheets)
+	new_time, _ = timed(evaluate, new_sheets)
+	rows.append((
+		f'"Actual hours" formula, 5 passes over {sheet_count} sheets',
+		f'{old_time * 1000:.1f} ms -> {new_time * 1000:.1f} ms ({old_time / new_time:.1f}x)'
+	))
+	report('Value types: plain classes vs __slots__ with cached deltas', rows)
+
+
+def _legacy_decode(data):
+	# The per-value type dispatch that Dataset.__init__ used before converters were compiled per format
+	sheets = {}
+	for sheet_name, sheet_data in data['sheets'].items():
+		format_spec = data['special'] if sheet_name == '__special__' else data['format']
+		for group_name, group_data in zip(format_spec.keys(), sheet_data):
+			for value_name, value in zip(format_spec[group_name], group_data):
+				value_type = format_spec[group_name][value_name]
+				if value_type in ('int', 'text'):
+					pass
+				elif value_type == 'float':
+					value = float(value)
+				elif value_type == 'price':
+					value = datasets.Price(value)
+				elif value_type == 'date':
+					value = datetime.date(*map(int, value.split('-')))
+				elif value_type == 'time':
+					value = datetime.time(*map(int, value.split(':')))
+				elif value_type == 'datetime':
+					value = datetime.datetime.fromisoformat(value)
+				elif value_type == 'timedelta':
+					subvalues = {'d': 0, 'h': 0, 'm': 0, 's': 0}
+					parse_temp = ''
+					for c in value:
+						if c.isdigit():
+							parse_temp += c
+						else:
+							subvalues[c] = int(parse_temp)
+							parse_temp = ''
+					value = datasets.Timedelta(
+						fmt=''.join(filter(str.isalpha, value)),
+						days=subvalues['d'],
+						hours=subvalues['h'],
+						minutes=subvalues['m'],
+						seconds=subvalues['s']
+					)
+				elif value_type.startswith('calcdelta'):
+					data_type = {
+						'd': datetime.date,
+						't': datetime.time,
+						'dt': datetime.datetime
+					}[value_type.split('_')[1]]
+					value = datasets.Calcdelta(*[data_type.fromisoformat(v) for v in value])
+				sheets.setdefault(sheet_name, {})
+				sheets[sheet_name].setdefault(group_name, {})
+				sheets[sheet_name][group_name][value_name] = value
+	return sheets
+
+
+def _cold_decode(data):
+	# Don't let the parser caches carry over between repetitions
+	for parser in (datasets.parse_date, datasets.parse_time, datasets.parse_timedelta):
+		parser.cache_clear()
+	return datasets.Dataset(data)
+
+
+def bench_loading(sheet_count=5000):
+	data = make_synthetic_data(sheet_count)
+	json_str = json.dumps(data)
+	rows = []
+	old_time, _ = timed(_legacy_decode, data)
+	new_time, _ = timed(_cold_decode, data)
+	rows.append((
+		f'Decode {sheet_count} sheets',
+		f'{old_time * 1000:.1f} ms -> {new_time * 1000:.1f} ms ({old_time / new_time:.1f}x)'
+	))
+	parse_time, _ = timed(json.loads, json_str)
+	rows.append((
+		f'Full load ({len(json_str) / 2**20:.1f} MiB of JSON)',
+		f'{(parse_time + old_time) * 1000:.1f} ms -> {(parse_time + new_time) * 1000:.1f} ms'
+	))
+	report('Loading: per-value type dispatch vs compiled converters', rows)
+
+
+def bench_duplication(sheet_count=5000):
+	dataset = datasets.Dataset(make_synthetic_data(sheet_count))
+	sheets = list(dataset.sheets.values())
+	rows = []
+	for label, duplicate in (
+		('copy.deepcopy', copy.deepcopy),
+		('Sheet.copy', datasets.Sheet.copy)
+	):
+		elapsed, _ = timed(lambda: [duplicate(sheet) for sheet in sheets], repeat=1)
+		size, copies = allocated(lambda: [duplicate(sheet) for sheet in sheets])
+		edit_size, _ = allocated(lambda: [sheet.set_value('POV Miles', 'Monday', 1) for sheet in copies])
+		rows.append((
+			f'{label} of {sheet_count} sheets',
+			f'{elapsed * 1000:.1f} ms, {size / sheet_count:.0f} bytes per copy, '
+			f'{edit_size / sheet_count:.0f} bytes per copy after editing one group'
+		))
+	report('Sheet duplication: deep copies vs copy-on-write', rows)
+
+
+def bench_cache(sheet_count=5000):
+	data = make_synthetic_data(sheet_count)
+	rows = []
+	with tempfile.TemporaryDirectory() as directory:
+		path = Path(directory) / 'dataset.json'
+		path.write_text(json.dumps(data, indent=4))
+		uncached, _ = timed(lambda: _cold_decode(json.loads(path.read_text())))
+		dataset_cache = cache.DatasetCache()
+		first, _ = timed(lambda: dataset_cache.load(path), repeat=1)
+		unchanged, _ = timed(lambda: dataset_cache.load(path))
+		os.utime(path, ns=(0, 0))
+		touched, _ = timed(lambda: dataset_cache.load(path), repeat=1)
+		data['sheets']['Pay period 1'][2][0] += 1
+		path.write_text(json.dumps(data, indent=4))
+		one_sheet, _ = timed(lambda: dataset_cache.load(path), repeat=1)
+		size = path.stat().st_size
+	for label, elapsed in (
+		(f'Read and parse ({size / 2**20:.1f} MiB, {sheet_count} sheets) without a cache', uncached),
+		('First load through the cache', first),
+		('Reload, file unchanged', unchanged),
+		('Reload, file touched but contents unchanged', touched),
+		('Reload, one sheet changed on disk', one_sheet)
+	):
+		rows.append((label, f'{elapsed * 1000:.1f} ms'))
+	report('Parsed-dataset cache', rows)
+
+
+def bench_snapshots(sheet_count=20000):
+	data = make_synthetic_data(sheet_count)
+	with tempfile.TemporaryDirectory() as directory:
+		path = Path(directory) / 'dataset.json'
+		path.write_text(json.dumps(data, indent=4))
+		snapshots = cache.SnapshotCache(Path(directory) / 'snapshots')
+		# A new session: nothing in memory, and the parsers' caches are cold
+		json_time, _ = timed(lambda: _cold_decode(json.loads(path.read_text())))
+		cache.DatasetCache(snapshots=snapshots).load(path)
+		snapshots.wait()
+		snapshot_time, _ = timed(lambda: cache.DatasetCache(snapshots=snapshots).load(path))
+		size = path.stat().st_size
+		snapshot_size = sum(p.stat().st_size for p in snapshots.directory.iterdir())
+	report('Opening in a new session: JSON vs snapshot', [
+		(f'Parse and decode ({size / 2**20:.1f} MiB of JSON, {sheet_count} sheets)', f'{json_time * 1000:.1f} ms'),
+		(
+			f'Load snapshot ({snapshot_size / 2**20:.1f} MiB)',
+			f'{snapshot_time * 1000:.1f} ms ({json_time / snapshot_time:.1f}x)'
+		)
+	])
+
+
+def _dict_sheets(dataset):
+	# Sheets as they were stored before they shared a schema: a dict of groups, each a dict of values
+	return {
+		name: {group_name: dict(group) for group_name, group in sheet.items()}
+		for name, sheet in dataset.sheets.items()
+	}
+
+
+def _compact_sheets(dataset):
+	return {
+		name: datasets.Sheet(dataset.schema, [tuple(group.values()) for group in sheet.values()])
+		for name, sheet in dataset.sheets.items()
+	}
+
+
+def bench_sheet_memory(sheet_count=20000):
+	dataset = datasets.Dataset(make_synthetic_data(sheet_count))
+	# Both build new containers around the same value objects, so only the containers are counted
+	rows = []
+	dict_size, _ = allocated(_dict_sheets, dataset)
+	compact_size, _ = allocated(_compact_sheets, dataset)
+	for label, size in (('Dicts of dicts', dict_size), ('Shared schema and value tuples', compact_size)):
+		rows.append((f'{label}, {sheet_count} sheets', f'{size / 2**20:.1f} MiB ({size / sheet_count:.0f} bytes per sheet)'))
+	rows.append(('Reduction', f'{dict_size / compact_size:.1f}x'))
+	report('Sheet storage: dicts of dicts vs shared schema', rows)
+
+
+def check_stream_parser(max_chunk_size=40):
+	"""
+	Checks that compressed files parse the same as with json.loads when chunks end anywhere in the text,
+	e.g. within strings, numbers or escapes, or between a key and its colon.
+	"""
+	data = make_synthetic_data(3)
+	data['sheets']['Quoted "name" \\ é'] = data['sheets']['Pay period 1']
+	data['sheets']['Empty'] = []
+	data['price_suffix'] = ' \u20ac'
+	for text in (json.dumps(data), json.dumps(data, indent=4)):
+		content = compression.gzip.compress(text.encode())
+		for chunk_size in range(1, max_chunk_size + 1):
+			compression.CHUNK_SIZE, default = chunk_size, compression.CHUNK_SIZE
+			try:
+				parsed, size = compression.load_data(content, 'dataset.json.gz')
+			finally:
+				compression.CHUNK_SIZE = default
+			if parsed != data or size != len(text):
+				raise AssertionError(f'Compressed file parsed differently with {chunk_size}-character chunks')
+
+
+def bench_compression(sheet_counts=(500, 5000, 20000)):
+	check_stream_parser()
+	rows = []
+	with tempfile.TemporaryDirectory() as directory:
+		for sheet_count in sheet_counts:
+			dataset = datasets.Dataset(make_synthetic_data(sheet_count))
+			plain_size = None
+			for suffix in compression.SUFFIXES:
+				path = Path(directory) / f'dataset{suffix}'
+				save_time, _ = timed(compression.save, dataset, path, repeat=1)
+				# No snapshots, so that every load reads and parses the file
+				open_time, _ = timed(lambda: cache.DatasetCache().load(path), repeat=1)
+				size = path.stat().st_size
+				plain_size = plain_size or size
+				rows.append((
+					f'{sheet_count} sheets, {suffix}',
+					f'{size / 2**20:.2f} MiB ({plain_size / size:.1f}x smaller), '
+					f'save {save_time * 1000:.0f} ms, open {open_time * 1000:.0f} ms'
+				))
+	report('Dataset files: plain vs compressed', rows)
+
+
+def _naive_sweep(dataset, parameters):
+	# Setting every combination in the special sheet and evaluating every formula, as done by hand
+	rows = []
+	for sheet in dataset.sheets.values():
+		for values in itertools.product(*parameters.values()):
+			special = dataset.special.copy()
+			for (group_name, value_name), value in zip(parameters, values):
+				special.set_value(group_name, value_name, value)
+			rows.append(dataset.evaluate(sheet, special))
+	return rows
+
+
+def check_sharded_changes(sheet_count=250, shard_size=100):
+	"""Checks that changes to sheets in shards that weren't read yet are saved and read back."""
+	dataset = datasets.Dataset(make_synthetic_data(sheet_count))
+	with tempfile.TemporaryDirectory() as directory:
+		path = Path(directory) / 'dataset.json'
+		sharding.split(dataset, path, size=shard_size)
+		sharded = cache.DatasetCache().load(path)
+		names = list(sharded.sheets)
+		sharded.rename_sheet(names[-10], 'Renamed')
+		sharded.remove_sheet(names[-20])
+		sharding.save(sharded, path)
+		dataset.rename_sheet(names[-10], 'Renamed')
+		dataset.remove_sheet(names[-20])
+		if json.loads(cache.DatasetCache().load(path).to_json()) != json.loads(dataset.to_json()):
+			raise AssertionError('Sharded dataset read back differently after renaming and removing sheets')
+
+
+def bench_sharding(sheet_count=20000, shard_size=1000):
+	check_sharded_changes()
+	dataset = datasets.Dataset(make_synthetic_data(sheet_count))
+	name = list(dataset.sheets)[sheet_count // 2]
+	rows = []
+	with tempfile.TemporaryDirectory() as directory:
+		path = Path(directory) / 'dataset.json'
+		compression.save(dataset, path)
+		regular = cache.DatasetCache().load(path)
+		regular.rename_sheet(name, 'Renamed')
+		regular_time, _ = timed(compression.save, regular, path, repeat=1)
+		rows.append(('Rename a sheet and save, regular file', f'{regular_time * 1000:.0f} ms'))
+		path = Path(directory) / 'sharded.json'
+		sharding.split(dataset, path, size=shard_size)
+		sharded = cache.DatasetCache().load(path)
+		sharded.rename_sheet(name, 'Renamed')
+		sharded_time, _ = timed(sharding.save, sharded, path, repeat=1)
+		rows.append((
+			f'Same, {shard_size} sheets per shard', f'{sharded_time * 1000:.0f} ms ({regular_time / sharded_time:.1f}x)'
+		))
+	report(f'Saving a change: regular vs sharded ({sheet_count} sheets)', rows)
+
+
+def bench_sweep(sheet_count=1000):
+	dataset = datasets.Dataset(make_synthetic_data(sheet_count))
+	parameters = {
+		('Other', 'Hourly wage'): sweep.parse_values('15:39.5:0.5', 'price'),
+		('Other', 'Overtime threshold'): [36, 38, 40, 42, 44]
+	}
+	evaluations = sheet_count * 50 * 5
+	rows = []
+	naive_time, _ = timed(_naive_sweep, dataset, parameters, repeat=1)
+	rows.append((f'Every formula per combination ({evaluations} evaluations)', f'{naive_time * 1000:.0f} ms'))
+	sweep_time, _ = timed(sweep.sweep, dataset, parameters, repeat=1)
+	rows.append(('Only formulas depending on the parameters', f'{sweep_time * 1000:.0f} ms ({naive_time / sweep_time:.1f}x)'))
+	workers = os.cpu_count() or 1
+	pool_time, _ = timed(sweep.sweep, dataset, parameters, workers=workers, repeat=1)
+	rows.append((f'Same, with worker processes ({workers})', f'{pool_time * 1000:.0f} ms ({naive_time / pool_time:.1f}x)'))
+	report('What-if sweep: 50 hourly wages x 5 overtime thresholds', rows)
+
+
+BENCHMARKS = {
+	'value_types': bench_value_types,
+	'loading': bench_loading,
+	'duplication': bench_duplication,
+	'cache': bench_cache,
+	'snapshots': bench_snapshots,
+	'sheet_memory': bench_sheet_memory,
+	'compression': bench_compression,
+	'sharding': bench_sharding,
+	'sweep': bench_sweep
+}
+
+
+if __name__ == '__main__':
+	for name in sys.argv[1:] or BENCHMARKS.keys():
+		BENCHMARKS[name]()
@@ -0,0 +1,250 @@
+import collections
+import functools
+import gc
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from pathlib import Path
+
+import compression
+import datasets
+import sharding
+import tracing
+
+
+class DatasetCache:
+	"""
+	Keeps recently loaded datasets in memory so that opening a file again doesn't need to parse it again.
+
+	Entries are keyed by path and validated by the file's modification time and size, and if those changed,
+	by a hash of its contents. If the contents did change, the new data is decoded reusing every sheet whose
+	raw data is the same as in the cached version. `load` always returns a copy of the cached dataset,
+	which can be edited freely.
+
+	The least recently used entries are dropped once the estimated memory used by all entries exceeds `max_bytes`.
+
+	If a `SnapshotCache` is given, files that aren't in memory are loaded from their snapshot when it's fresh,
+	and snapshots of newly decoded files are written in the background.
+	"""
+	# Measured memory use of a decoded dataset (including its raw data) per byte of pretty-printed JSON
+	MEMORY_PER_FILE_BYTE = 4
+	# The same per character of compact JSON, as in compressed files
+	MEMORY_PER_COMPACT_BYTE = 12
+
+	def __init__(self, max_bytes=256 * 2**20, snapshots=None):
+		self.max_bytes = max_bytes
+		self.snapshots = snapshots
+		self.memory_usage = 0
+		self._entries = collections.OrderedDict()
+		# Datasets may be loaded in a background thread while the GUI checks for changes to another file
+		self._lock = threading.RLock()
+
+	def load(self, path, progress=None):
+		"""
+		Returns a copy of the dataset at `path`. `progress` is passed to `datasets.Dataset` if the file
+		needs to be decoded; it's also called with `(0, 0)` before reading and parsing, which can't report progress.
+		"""
+		with self._lock:
+			return self._load(Path(path).resolve(), progress)
+
+	def _load(self, path, progress):
+		stat = path.stat()
+		entry = self._entries.get(path)
+		if entry is not None and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+			self._entries.move_to_end(path)
+			return entry.dataset.copy()
+		if progress is not None:
+			progress(0, 0)
+		with tracing.span('read file', path=str(path)), open(path, 'rb') as f:
+			content = f.read()
+		with tracing.span('hash', size=len(content)):
+			digest = hashlib.blake2b(content).digest()
+		module = compression.compression_of(path)
+		if module is None:
+			memory_usage = len(content) * self.MEMORY_PER_FILE_BYTE
+		else:
+			# Until the file is parsed, estimate the size of its uncompressed text
+			memory_usage = len(content) * compression.EXPANSION[module] * self.MEMORY_PER_COMPACT_BYTE
+		if entry is not None and entry.digest == digest:
+			dataset = entry.dataset
+			memory_usage = entry.memory_usage
+		else:
+			dataset = self.snapshots.load(digest) if self.snapshots else None
+			if dataset is None:
+				# Compressed files are hashed before decompressing, which also makes hashing cheaper
+				data, text_size = compression.load_data(content, path)
+				if module is not None:
+					memory_usage = text_size * self.MEMORY_PER_COMPACT_BYTE
+				if sharding.is_manifest(data):
+					# Only the manifest is read here; shards are read when their sheets are used
+					dataset = sharding.from_manifest(data, path)
+				else:
+					dataset = datasets.Dataset(data, previous=entry.dataset if entry else None, progress=progress)
+				# Manifests are quick to read, and their shards are found relative to where they are
+				if self.snapshots and not sharding.is_sharded(dataset):
+					self.snapshots.store_in_background(digest, dataset)
+		self.discard(path)
+		entry = _Entry(stat.st_mtime_ns, len(content), digest, dataset, memory_usage)
+		self._entries[path] = entry
+		self.memory_usage += entry.memory_usage
+		while self.memory_usage > self.max_bytes and len(self._entries) > 1:
+			self.memory_usage -= self._entries.popitem(last=False)[1].memory_usage
+		return dataset.copy()
+
+	def discard(self, path):
+		with self._lock:
+			entry = self._entries.pop(Path(path).resolve(), None)
+			if entry is not None:
+				self.memory_usage -= entry.memory_usage
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.memory_usage = 0
+
+
+class _Entry:
+	__slots__ = ('mtime_ns', 'size', 'digest', 'dataset', 'memory_usage')
+
+	def __init__(self, mtime_ns, size, digest, dataset, memory_usage):
+		self.mtime_ns = mtime_ns
+		self.size = size
+		self.digest = digest
+		self.dataset = dataset
+		# Estimated bytes used by the dataset
+		self.memory_usage = memory_usage
+
+
+def default_snapshot_directory():
+	"""Returns the per-user cache directory for dataset snapshots, following the conventions of each platform."""
+	if sys.platform == 'win32':
+		base = Path(os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local')
+	elif sys.platform == 'darwin':
+		base = Path.home() / 'Library' / 'Caches'
+	else:
+		base = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache')
+	return base / 'DatasheetCalculator' / 'snapshots'
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+	"""Identifies the code that snapshots depend on; snapshots written by other versions are ignored."""
+	version = hashlib.blake2b(Path(datasets.__file__).read_bytes(), digest_size=16)
+	version.update(f'{sys.version_info[:2]} {pickle.HIGHEST_PROTOCOL}'.encode())
+	return version.digest()
+
+
+class SnapshotCache:
+	"""
+	Stores fully decoded datasets on disk as pickles, so that opening an unchanged file in a new session
+	skips parsing and decoding it.
+
+	Snapshots are named after the hash of the JSON contents they were decoded from, so a snapshot can only be
+	fresh or missing, never out of date. Each one starts with `code_version()`, and snapshots written by other
+	code are treated as missing. The least recently used snapshots are deleted once they use more than
+	`max_bytes` of disk space in total.
+
+	Snapshots are only ever read from the current user's cache directory, as unpickling runs arbitrary code.
+	"""
+	MAGIC = b'DSCSNAP1'
+	# Temporary files that weren't written to for this long were left by writers that were killed
+	STALE_TEMPORARY_SECONDS = 60 * 60
+
+	def __init__(self, directory=None, max_bytes=512 * 2**20):
+		self.directory = Path(directory) if directory else default_snapshot_directory()
+		self.max_bytes = max_bytes
+		self._threads = []
+		self._lock = threading.Lock()
+
+	def path(self, digest):
+		return self.directory / f'{digest.hex()}.pickle'
+
+	@tracing.traced('load snapshot')
+	def load(self, digest):
+		"""Returns the dataset stored for the JSON contents with the given hash, or None if there is none."""
+		path = self.path(digest)
+		# Unpickling creates millions of objects and no garbage, so cyclic GC passes would only double the time
+		gc_enabled = gc.isenabled()
+		gc.disable()
+		try:
+			with open(path, 'rb') as f:
+				if f.read(len(self.MAGIC)) != self.MAGIC or f.read(len(code_version())) != code_version():
+					raise ValueError('Snapshot written by other code')
+				dataset = pickle.load(f)
+		except FileNotFoundError:
+			return None
+		except Exception:
+			# Stale or damaged; it will be written again
+			path.unlink(missing_ok=True)
+			return None
+		finally:
+			if gc_enabled:
+				gc.enable()
+		# Mark it as recently used
+		os.utime(path)
+		return dataset
+
+	@tracing.traced('store snapshot')
+	def store(self, digest, dataset):
+		self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+		path = self.path(digest)
+		temporary = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}')
+		try:
+			with open(temporary, 'wb') as f:
+				f.write(self.MAGIC)
+				f.write(code_version())
+				pickle.dump(dataset, f, pickle.HIGHEST_PROTOCOL)
+			os.replace(temporary, path)
+		finally:
+			temporary.unlink(missing_ok=True)
+		self.prune()
+
+	def store_in_background(self, digest, dataset):
+		"""
+		Calls `store` in a thread. `dataset` must not be modified afterwards; datasets kept by `DatasetCache`
+		never are, as it only hands out copies.
+		"""
+		thread = threading.Thread(target=self._store_quietly, args=(digest, dataset), daemon=True)
+		with self._lock:
+			self._threads = [t for t in self._threads if t.is_alive()]
+			self._threads.append(thread)
+		thread.start()
+
+	def wait(self):
+		"""Waits for snapshots being written in the background, e.g. before the program exits."""
+		with self._lock:
+			threads, self._threads = self._threads, []
+		for thread in threads:
+			thread.join()
+
+	def prune(self):
+		with self._lock:
+			try:
+				snapshots = [(p.stat(), p) for p in self.directory.glob('*.pickle')]
+				temporaries = [(p.stat(), p) for p in self.directory.glob('.*.pickle.*')]
+			except FileNotFoundError:
+				return
+			for stat, path in temporaries:
+				if time.time() - stat.st_mtime > self.STALE_TEMPORARY_SECONDS:
+					path.unlink(missing_ok=True)
+			total = sum(stat.st_size for stat, _ in snapshots)
+			for stat, path in sorted(snapshots, key=lambda s: s[0].st_mtime_ns):
+				if total <= self.max_bytes:
+					break
+				path.unlink(missing_ok=True)
+				total -= stat.st_size
+
+	def clear(self):
+		for pattern in ('*.pickle', '.*.pickle.*'):
+			for path in self.directory.glob(pattern):
+				path.unlink(missing_ok=True)
+
+	def _store_quietly(self, digest, dataset):
+		try:
+			self.store(digest, dataset)
+		except OSError as e:
+			# A missing snapshot only costs time
+			sys.stderr.write(f'Could not write dataset snapshot: {e}\n')
@@ -0,0 +1,177 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
+import re
+from pathlib import Path
+
+import datasets
+import tracing
+
+
+# Compression of dataset files, by the last suffix of their name
+COMPRESSION = {'.gz': gzip, '.xz': lzma, '.bz2': bz2}
+SUFFIXES = ('.json', '.json.gz', '.json.xz', '.json.bz2')
+# File dialog filters
+OPEN_FILTER = f'Datasets ({" ".join("*" + suffix for suffix in SUFFIXES)});;All files (*.*)'
+SAVE_FILTER = ';;'.join(
+	f'{label} (*{suffix})' for label, suffix in zip(
+		('Datasets', 'Datasets, gzip-compressed', 'Datasets, xz-compressed', 'Datasets, bzip2-compressed'), SUFFIXES
+	)
+)
+# Uncompressed characters read at a time when parsing a compressed file
+CHUNK_SIZE = 64 * 2**10
+# Measured ratio of uncompressed to compressed size of (compact) dataset files, to estimate sizes without decompressing
+EXPANSION = {gzip: 6, lzma: 8, bz2: 10}
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def compression_of(path):
+	"""Returns the module (gzip, lzma or bz2) compressing the file at `path` according to its suffix, or None."""
+	return COMPRESSION.get(Path(path).suffix.lower())
+
+
+def open_file(path, mode='r', like=None):
+	"""
+	Opens a dataset file, compressed according to the suffix of `like` (e.g. the final name of a temporary file)
+	or of `path` itself. Compressed files are opened in text mode with UTF-8, like plain ones usually are.
+	"""
+	module = compression_of(like or path)
+	if module is None:
+		return open(path, mode)
+	if 'b' not in mode:
+		mode = mode.replace('t', '') + 't'
+		return module.open(path, mode, encoding='utf-8')
+	return module.open(path, mode)
+
+
+def load_data(content, path):
+	"""
+	Returns the raw data (as loaded from JSON) of the dataset file `path`, whose bytes are `content`,
+	and the length of its uncompressed text. Compressed files are decompressed and parsed a sheet at a time,
+	so their uncompressed text is never in memory as a whole.
+	"""
+	module = compression_of(path)
+	if module is None:
+		with tracing.span('json.loads', size=len(content)):
+			return json.loads(content), len(content)
+	with tracing.span('decompress and parse', size=len(content), compression=module.__name__):
+		with module.open(io.BytesIO(content), 'rt', encoding='utf-8') as f:
+			stream = _JSONStream(f)
+			return stream.read_dataset(), stream.size
+
+
+def save(dataset, path):
+	"""
+	Writes a regular (not sharded) dataset to `path`, compressed according to its suffix. Plain files are
+	pretty-printed like `Dataset.to_json`; compressed ones are written as compact JSON, a sheet at a time.
+	"""
+	if compression_of(path) is None:
+		with open(path, 'w') as f:
+			f.write(dataset.to_json())
+		return
+	with tracing.span('write compressed', path=str(path)), open_file(path, 'w') as f:
+		dump(dataset, f)
+
+
+def dump(dataset, fp):
+	"""Writes a dataset to a text stream as compact JSON, encoding one sheet at a time."""
+	header = json.dumps(dataset.header_data(), cls=datasets.DatasetEncoder)
+	# The header always has a name and format, so it ends with a value that the sheets can follow
+	fp.write(f'{header[:-1]}, "sheets": {{')
+	for i, (name, sheet_data) in enumerate(dataset.iter_raw_sheets()):
+		fp.write(f'{", " if i else ""}{json.dumps(name)}: {json.dumps(sheet_data, cls=datasets.DatasetEncoder)}')
+	fp.write('}}')
+
+
+class _JSONStream:
+	"""
+	Parses a dataset's JSON from a text stream, reading `CHUNK_SIZE` characters at a time. The top-level
+	object and the object of sheets are read a member at a time; every other value is parsed at once
+	by the standard decoder as soon as it's complete in the buffer.
+	"""
+	def __init__(self, fp):
+		self._fp = fp
+		self._buffer = ''
+		self._pos = 0
+		# Characters dropped from the start of the buffer, to report where errors are in the file
+		self._offset = 0
+		# Characters read so far
+		self.size = 0
+		self._eof = False
+		self._decoder = json.JSONDecoder()
+
+	def read_dataset(self):
+		data = {}
+		for key in self._members():
+			data[key] = dict(self._members_with_values()) if key == 'sheets' else self._value()
+		self._skip_whitespace()
+		if self._pos < len(self._buffer):
+			raise self._error('Extra data')
+		return data
+
+	def _members_with_values(self):
+		for key in self._members():
+			yield key, self._value()
+
+	def _members(self):
+		# Yields the keys of an object; the caller reads each value before asking for the next key
+		self._expect('{')
+		if self._peek() == '}':
+			self._pos += 1
+			return
+		while True:
+			key = self._value()
+			if not isinstance(key, str):
+				raise self._error('Expecting property name')
+			self._expect(':')
+			yield key
+			if self._expect(',}') == '}':
+				return
+
+	def _value(self):
+		self._skip_whitespace()
+		while True:
+			try:
+				value, end = self._decoder.raw_decode(self._buffer, self._pos)
+				# A number at the end of the buffer may continue in the next chunk
+				if end < len(self._buffer) or self._eof:
+					self._pos = end
+					return value
+			except json.JSONDecodeError as e:
+				if self._eof:
+					raise self._error(e.msg, e.pos) from None
+			self._fill()
+
+	def _fill(self):
+		chunk = self._fp.read(CHUNK_SIZE)
+		if not chunk:
+			self._eof = True
+		self.size += len(chunk)
+		self._offset += self._pos
+		self._buffer = self._buffer[self._pos:] + chunk
+		self._pos = 0
+
+	def _skip_whitespace(self):
+		while True:
+			self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+			if self._pos < len(self._buffer) or self._eof:
+				return
+			self._fill()
+
+	def _peek(self):
+		self._skip_whitespace()
+		return self._buffer[self._pos:self._pos + 1]
+
+	def _expect(self, characters):
+		c = self._peek()
+		if not c or c not in characters:
+			raise self._error(f'Expecting {" or ".join(repr(c) for c in characters)}')
+		self._pos += 1
+		return c
+
+	def _error(self, message, pos=None):
+		# The buffer only has the end of the text read so far, so only the offset can be given
+		return ValueError(f'{message} at character {self._offset + (self._pos if pos is None else pos)}')
@@ -1,23 +1,39 @@
+import collections.abc
+import contextlib
 import datetime
+import functools
 import itertools
 import json
+import re
 import sys
+
+import tracing
+
 # TODO: use the "ambiguous time string" mechanism for single date/time/datetime values
 
+SPECIAL_SHEET = '__special__'
+DEFAULT_SHEET = '__default__'
+
 
 class Price(float):
-	...
+	__slots__ = ()
 
 
 class Timedelta(datetime.timedelta):
+	__slots__ = ('fmt',)
+
 	def __new__(cls, *args, fmt, **kwargs):
 		self = super().__new__(cls, *args, **kwargs)
 		self.fmt = fmt
 		return self
 
+	def __reduce__(self):
+		# The base class reduces to ``cls(days, seconds, microseconds)``, which would lose ``fmt``
+		return functools.partial(type(self), fmt=self.fmt), (self.days, self.seconds, self.microseconds)
+
 	def fmt_values(self):
 		values = {}
-		seconds = self.total_seconds()
+		seconds = int(self.total_seconds())
 		for c in sorted(self.fmt, key='dhms'.index):
 			coefficient = {
 				's': 1, 'm': 60, 'h': 60*60, 'd': 60*60*24
@@ -30,18 +46,53 @@ class Timedelta(datetime.timedelta):
 
 
 class Calcdelta:
+	__slots__ = ('_start', '_end', '_delta', 'data_type')
+
 	def __init__(self, start, end):
-		self.start = start
-		self.end = end
+		self._start = start
+		self._end = end
+		self._delta = None
 		if not (isinstance(end, type(start)) or isinstance(start, type(end))):
 			raise TypeError(
 				f'The value types passed to Calcdelta must be equivalent (got {type(start)} and {type(end)})'
 			)
 		self.data_type = type(start)
 
+	def __reduce__(self):
+		return type(self), (self._start, self._end)
+
+	def __eq__(self, other):
+		if not isinstance(other, Calcdelta):
+			return NotImplemented
+		return (self._start, self._end) == (other._start, other._end)
+
+	# Mutable, so not hashable
+	__hash__ = None
+
+	@property
+	def start(self):
+		return self._start
+
+	@start.setter
+	def start(self, value):
+		self._start = value
+		self._delta = None
+
+	@property
+	def end(self):
+		return self._end
+
+	@end.setter
+	def end(self, value):
+		self._end = value
+		self._delta = None
+
 	@property
 	def delta(self):
-		return calculate_delta(self.start, self.end)
+		# Formulas tend to access this for every value of every sheet, so it's only calculated once
+		if self._delta is None:
+			self._delta = calculate_delta(self._start, self._end)
+		return self._delta
 
 
 def calculate_delta(arg1, arg2):
@@ -71,12 +122,286 @@ def calculate_delta(arg1, arg2):
 	)
 
 
+class Schema:
+	"""
+	The group and value names of a format specification, stored once and shared by every sheet using it.
+	Sheets store their values in tuples ordered like the format, and find them through the positions here.
+	"""
+	__slots__ = ('group_names', 'value_names', 'group_positions', 'value_positions')
+
+	def __init__(self, format_spec):
+		self.group_names = tuple(format_spec)
+		self.value_names = tuple(tuple(group_format) for group_format in format_spec.values())
+		self.group_positions = {name: i for i, name in enumerate(self.group_names)}
+		self.value_positions = tuple({name: i for i, name in enumerate(names)} for names in self.value_names)
+
+	def __repr__(self):
+		return f'{type(self).__name__}({dict(zip(self.group_names, self.value_names))!r})'
+
+
+class Group(collections.abc.Mapping):
+	"""A read-only mapping of value names to the values of one group of a sheet."""
+	__slots__ = ('_positions', '_values')
+
+	def __init__(self, positions, values):
+		self._positions = positions
+		self._values = values
+
+	def __getitem__(self, value_name):
+		i = self._positions[value_name]
+		# Raw data may leave out the last values of a group
+		if i >= len(self._values):
+			raise KeyError(value_name)
+		return self._values[i]
+
+	def __iter__(self):
+		return itertools.islice(self._positions, len(self._values))
+
+	def __len__(self):
+		return len(self._values)
+
+	def __eq__(self, other):
+		if isinstance(other, Group) and other._positions is self._positions:
+			return self._values == other._values
+		return super().__eq__(other)
+
+	def __repr__(self):
+		return f'{type(self).__name__}({dict(self.items())!r})'
+
+	def values(self):
+		return _GroupValues(self)
+
+	def items(self):
+		return _GroupItems(self)
+
+
+class _GroupValues(collections.abc.ValuesView):
+	__slots__ = ()
+
+	def __iter__(self):
+		return iter(self._mapping._values)
+
+
+class _GroupItems(collections.abc.ItemsView):
+	__slots__ = ()
+
+	def __iter__(self):
+		return zip(self._mapping._positions, self._mapping._values)
+
+
+class Sheet(collections.abc.Mapping):
+	"""
+	A mapping of group names to groups of values, stored as one tuple of values per group, in the order
+	of the `Schema` of its format. Groups are read-only `Group` views. Since the tuples are never modified,
+	copies share all of them and copying is O(1); writing a value replaces the tuple of its group only,
+	so edits never leak between sheets. Values themselves are always replaced, never modified in place.
+	"""
+	__slots__ = ('_schema', '_groups')
+
+	def __init__(self, schema, groups=()):
+		self._schema = schema
+		# Raw data may leave out the last groups and values, so tuples can be shorter than the schema
+		self._groups = tuple(groups)
+
+	@classmethod
+	def from_mapping(cls, schema, groups):
+		"""Creates a sheet from a mapping of group names to mappings of value names to values."""
+		sheet = cls(schema)
+		for group_name, values in groups.items():
+			sheet.set_group(group_name, values)
+		return sheet
+
+	@property
+	def schema(self):
+		return self._schema
+
+	def __getitem__(self, group_name):
+		i = self._schema.group_positions[group_name]
+		if i >= len(self._groups):
+			raise KeyError(group_name)
+		return Group(self._schema.value_positions[i], self._groups[i])
+
+	def __iter__(self):
+		return itertools.islice(self._schema.group_names, len(self._groups))
+
+	def __len__(self):
+		return len(self._groups)
+
+	def __contains__(self, group_name):
+		return self._schema.group_positions.get(group_name, len(self._groups)) < len(self._groups)
+
+	def __repr__(self):
+		return f'{type(self).__name__}({ {name: dict(group) for name, group in self.items()}!r})'
+
+	def copy(self):
+		sheet = type(self).__new__(type(self))
+		sheet._schema = self._schema
+		sheet._groups = self._groups
+		return sheet
+
+	def set_value(self, group_name, value_name, value):
+		group_index = self._schema.group_positions[group_name]
+		i = self._schema.value_positions[group_index][value_name]
+		values = self._groups[group_index]
+		if i >= len(values):
+			raise KeyError(value_name)
+		self._replace_group(group_index, values[:i] + (value,) + values[i + 1:])
+
+	def set_group(self, group_name, values):
+		"""Replaces a whole group with the values of the mapping `values`, which must use the sheet's value names."""
+		group_index = self._schema.group_positions[group_name]
+		positions = self._schema.value_positions[group_index]
+		if isinstance(values, Group) and values._positions is positions:
+			# Share the tuple of a sheet with the same format
+			self._replace_group(group_index, values._values)
+			return
+		group = []
+		for value_name in self._schema.value_names[group_index]:
+			if value_name not in values:
+				break
+			group.append(values[value_name])
+		if len(group) != len(values):
+			unknown = [name for name in values if name not in positions or positions[name] >= len(group)]
+			raise KeyError(f'Values not in the format of group {group_name} (or after a missing value): {unknown}')
+		self._replace_group(group_index, tuple(group))
+
+	def _replace_group(self, group_index, values):
+		groups = self._groups
+		if group_index >= len(groups):
+			# Only the last group can be added to a sheet whose raw data left out groups
+			if group_index > len(groups):
+				raise KeyError(self._schema.group_names[len(groups)])
+			self._groups = groups + (values,)
+		else:
+			self._groups = groups[:group_index] + (values,) + groups[group_index + 1:]
+
+	def unshared_groups(self, other):
+		"""Returns the names of groups whose data isn't shared with `other` (which may be None)."""
+		names = self._schema.group_names
+		if other is None or other._schema is not self._schema:
+			return list(names[:len(self._groups)])
+		return [
+			names[i] for i, values in enumerate(self._groups)
+			if i >= len(other._groups) or other._groups[i] is not values
+		]
+
+	def group_size(self, group_name):
+		"""Returns the approximate number of bytes used by a group and its values."""
+		values = self._groups[self._schema.group_positions[group_name]]
+		return sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+
+
+_TIMEDELTA_PART = re.compile(r'(\d+)([dhms])')
+_TIMEDELTA_NUMBER = re.compile(r'\d+')
+_TIMEDELTA_UNITS = {'s': 1, 'm': 60, 'h': 60*60, 'd': 60*60*24}
+
+
+# Parsed values are immutable and the same strings repeat a lot across sheets (e.g. "00:00:00"),
+# so the parsers below share results between identical inputs.
+@functools.lru_cache(maxsize=4096)
+def parse_date(value):
+	try:
+		return datetime.date.fromisoformat(value)
+	except ValueError:
+		# Also accept dates without zero padding, e.g. 2022-1-5
+		return datetime.date(*map(int, value.split('-')))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_time(value):
+	try:
+		return datetime.time.fromisoformat(value)
+	except ValueError:
+		return datetime.time(*map(int, value.split(':')))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_timedelta(value):
+	seconds = 0
+	for number, unit in _TIMEDELTA_PART.findall(value):
+		seconds += int(number) * _TIMEDELTA_UNITS[unit]
+	return Timedelta(fmt=_TIMEDELTA_NUMBER.sub('', value), seconds=seconds)
+
+
+def _calcdelta_parser(parse):
+	def parse_calcdelta(value):
+		return Calcdelta(*map(parse, value))
+	return parse_calcdelta
+
+
+def _keep(value):
+	return value
+
+
+VALUE_PARSERS = {
+	'text': _keep,
+	'int': _keep,
+	'float': float,
+	'price': Price,
+	'date': parse_date,
+	'time': parse_time,
+	'datetime': datetime.datetime.fromisoformat,
+	'timedelta': parse_timedelta,
+	'calcdelta_d': _calcdelta_parser(parse_date),
+	'calcdelta_t': _calcdelta_parser(parse_time),
+	'calcdelta_dt': _calcdelta_parser(datetime.datetime.fromisoformat)
+}
+
+
+def compile_converters(format_spec):
+	"""
+	Turns a format specification (the `format` or `special` value of a dataset) into a list
+	of `(group name, value names, parsers)` tuples, one per group and in the same order.
+	The value names and parsers are position-indexed lists matching the values of the group,
+	so that decoding a sheet doesn't need to look up value types again.
+	"""
+	converters = []
+	for group_name, group_format in format_spec.items():
+		parsers = []
+		for value_name, value_type in group_format.items():
+			try:
+				parsers.append(VALUE_PARSERS[value_type])
+			except KeyError:
+				raise ValueError(
+					f'Unknown data type {value_type} in group {group_name} for value {value_name}'
+				) from None
+		converters.append((group_name, list(group_format.keys()), parsers))
+	return converters
+
+
+def decode_sheet(sheet_data, converters, schema):
+	"""
+	Converts raw sheet data (a list of value lists) into a `Sheet` with the given `Schema`,
+	using `compile_converters` output for the same format.
+	"""
+	return Sheet(schema, [
+		tuple([parse(value) for parse, value in zip(parsers, group_data)])
+		for (_, _, parsers), group_data in zip(converters, sheet_data)
+	])
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_formula(formula):
+	return compile(formula, '<formula>', 'eval')
+
+
 class Dataset:
 	@classmethod
-	def from_json(cls, json_str):
-		return cls(json.loads(json_str))
+	def from_json(cls, json_str, previous=None):
+		with tracing.span('json.loads', size=len(json_str)):
+			data = json.loads(json_str)
+		return cls(data, previous)
+
+	# Sheets decoded between calls to the `progress` callback of __init__
+	PROGRESS_INTERVAL = 256
 
-	def __init__(self, data):
+	def __init__(self, data, previous=None, progress=None):
+		"""
+		If `previous` is an unmodified Dataset loaded from an earlier version of the same data,
+		sheets whose raw data didn't change are copied from it instead of being decoded again.
+		If given, `progress` is called with the number of sheets decoded so far and the total number of sheets
+		every `PROGRESS_INTERVAL` sheets; it may raise an exception to stop decoding.
+		"""
 		self._data = data
 		self.name = data['name']
 		self.price_prefix = data.get('price_prefix', '$')
@@ -87,66 +412,89 @@ class Dataset:
 		self.special_format = data.get('special', None)
 		self.groups = self.format.keys()
 		self.sheets = {}
-		for sheet_name, sheet_data in data['sheets'].items():
-			format_spec = self.special_format if sheet_name == '__special__' else self.format
-			for group_name, group_data in zip(format_spec.keys(), sheet_data):
-				for value_name, value in zip(format_spec[group_name], group_data):
-					value_type = format_spec[group_name][value_name]
-					if value_type in ('int', 'text'):
-						# Preserve the type
-						pass
-					elif value_type == 'float':
-						value = float(value)
-					elif value_type == 'price':
-						value = Price(value)
-					elif value_type == 'date':
-						value = datetime.date(*map(int, value.split('-')))
-					elif value_type == 'time':
-						value = datetime.time(*map(int, value.split(':')))
-					elif value_type == 'datetime':
-						value = datetime.datetime.fromisoformat(value)
-					elif value_type == 'timedelta':
-						subvalues = {'d': 0, 'h': 0, 'm': 0, 's': 0}
-						parse_temp = ''
-						for c in value:
-							if c.isdigit():
-								parse_temp += c
-							else:
-								subvalues[c] = int(parse_temp)
-								parse_temp = ''
-						value = Timedelta(
-							fmt=''.join(filter(str.isalpha, value)),
-							days=subvalues['d'],
-							hours=subvalues['h'],
-							minutes=subvalues['m'],
-							seconds=subvalues['s']
-						)
-					elif value_type.startswith('calcdelta'):
-						data_type = {
-							'd': datetime.date,
-							't': datetime.time,
-							'dt': datetime.datetime
-						}[value_type.split('_')[1]]
-						args = []
-						for v in value:
-							args.append(data_type.fromisoformat(v))
-						value = Calcdelta(*args)
-					else:
-						raise ValueError(
-							f'Unknown data type {value_type} in group {group_name} for value {value_name}'
-						)
-					self.sheets.setdefault(sheet_name, {})
-					self.sheets[sheet_name].setdefault(group_name, {})
-					self.sheets[sheet_name][group_name][value_name] = value
-		self.default = self.sheets.pop('__default__', None) or self.generate_default()
-		self.special = self.sheets.pop('__special__', None)
+		converters = compile_converters(self.format)
+		special_converters = compile_converters(self.special_format) if self.special_format else None
+		if previous is not None and (previous.format, previous.special_format) != (self.format, self.special_format):
+			previous = None
+		# Shared by all sheets, so that they only store their values; reused sheets keep the previous ones
+		if previous is not None:
+			self.schema, self.special_schema = previous.schema, previous.special_schema
+		else:
+			self.schema = Schema(self.format)
+			self.special_schema = Schema(self.special_format) if self.special_format else None
+		with tracing.span('decode sheets', sheets=len(data['sheets']), reusing=previous is not None):
+			total = len(data['sheets'])
+			for i, (sheet_name, sheet_data) in enumerate(data['sheets'].items()):
+				if progress is not None and not i % self.PROGRESS_INTERVAL:
+					progress(i, total)
+				if previous is not None and previous._data['sheets'].get(sheet_name) == sheet_data:
+					self.sheets[sheet_name] = previous.get_raw_sheet(sheet_name).copy()
+					continue
+				if sheet_name == SPECIAL_SHEET:
+					self.sheets[sheet_name] = decode_sheet(sheet_data, special_converters, self.special_schema)
+				else:
+					self.sheets[sheet_name] = decode_sheet(sheet_data, converters, self.schema)
+		self.default = self.sheets.pop(DEFAULT_SHEET, None) or self.generate_default()
+		self.special = self.sheets.pop(SPECIAL_SHEET, None)
+		self.listeners = []
+		self._text_index = None
+		self._time_index = None
+		self._transaction_depth = 0
+
+	def __getstate__(self):
+		# Listeners, indexes and transactions belong to this object only, and dict views can't be pickled
+		state = self.__dict__.copy()
+		del state['groups']
+		state['listeners'] = []
+		state['_transaction_depth'] = 0
+		state['_text_index'] = None
+		state['_time_index'] = None
+		# The raw sheets are about as big as the decoded ones and only serve to reuse unchanged sheets when the
+		# file is read again; keep the rest of the raw data, and which reserved sheets the file had
+		state['_data'] = {k: v for k, v in self._data.items() if k != 'sheets'}
+		state['_data']['sheets'] = {
+			name: None for name in (SPECIAL_SHEET, DEFAULT_SHEET) if name in self._data['sheets']
+		}
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.groups = self.format.keys()
+
+	def copy(self):
+		"""Returns a copy whose sheets can be edited independently. Sheets are copied on write, so this is cheap."""
+		# Not copy.copy(), which goes through __getstate__ and would leave out the raw sheets
+		dataset = object.__new__(type(self))
+		dataset.__dict__.update(self.__dict__)
+		dataset.formulas = dict(self.formulas)
+		dataset.results = dict(self.results)
+		if isinstance(self.sheets, dict):
+			dataset.sheets = {name: sheet.copy() for name, sheet in self.sheets.items()}
+		else:
+			# sharding.ShardedSheets, which copies only the sheets that were loaded
+			dataset.sheets = self.sheets.copy()
+		dataset.default = self.default.copy()
+		dataset.special = self.special.copy() if self.special else None
+		dataset.listeners = []
+		dataset._text_index = None
+		dataset._time_index = None
+		dataset._transaction_depth = 0
+		return dataset
+
+	def get_raw_sheet(self, raw_name):
+		"""Returns a sheet by its name in the raw data, where the default and special sheets have reserved names."""
+		if raw_name == DEFAULT_SHEET:
+			return self.default
+		if raw_name == SPECIAL_SHEET:
+			return self.special
+		return self.sheets[raw_name]
 
 	def generate_default(self):
-		sheet = {}
+		groups = {}
 		for group_name, group_d in self.format.items():
-			sheet[group_name] = {}
+			groups[group_name] = {}
 			for val_name, val_type in group_d.items():
-				sheet[group_name][val_name] = {
+				groups[group_name][val_name] = {
 					'text': '',
 					'int': 0,
 					'float': 0.0,
@@ -166,8 +514,138 @@ class Dataset:
 						datetime.datetime.combine(datetime.date.today(), datetime.time())
 					)
 				}[val_type]
+		return Sheet.from_mapping(self.schema, groups)
+
+	def get_sheet(self, name):
+		"""Returns the sheet with the given name; `SPECIAL_SHEET` refers to the special sheet."""
+		if name == SPECIAL_SHEET:
+			return self.special
+		return self.sheets[name]
+
+	def has_sheet(self, name):
+		if name == SPECIAL_SHEET:
+			return self.special is not None
+		return name in self.sheets
+
+	def sheet_index(self, name):
+		if name == SPECIAL_SHEET:
+			return -1
+		return list(self.sheets).index(name)
+
+	def set_value(self, sheet_name, group_name, value_name, value):
+		sheet = self.get_sheet(sheet_name)
+		old_value = sheet[group_name][value_name]
+		sheet.set_value(group_name, value_name, value)
+		self._notify('value_changed', sheet_name, group_name, value_name, old_value, value)
+
+	def replace_sheet(self, name, sheet):
+		"""Replaces the contents of an existing sheet, keeping its position."""
+		self._notify('sheet_removed', name, self.get_sheet(name))
+		if name == SPECIAL_SHEET:
+			self.special = sheet
+			self.special_schema = sheet.schema
+		else:
+			self.sheets[name] = sheet
+		self._notify('sheet_added', name, sheet)
+
+	def insert_sheet(self, name, sheet, index=None, special_format=None):
+		"""
+		Adds a sheet at `index`, or at the end if `index` is None. Inserting anywhere but at the end
+		rebuilds `sheets`, as dicts can't insert in the middle. When re-adding the special sheet,
+		`special_format` restores its format.
+		"""
+		if name == SPECIAL_SHEET:
+			self.special = sheet
+			self.special_schema = sheet.schema
+			if special_format is not None:
+				self.special_format = special_format
+		elif index is None or index >= len(self.sheets):
+			self.sheets[name] = sheet
+		elif not isinstance(self.sheets, dict):
+			self.sheets.insert(index, name, sheet)
+		else:
+			items = list(self.sheets.items())
+			items.insert(index, (name, sheet))
+			self.sheets = dict(items)
+		self._notify('sheet_added', name, sheet)
+
+	def remove_sheet(self, name):
+		"""Removes and returns a sheet. Removing the special sheet also removes its format."""
+		if name == SPECIAL_SHEET:
+			sheet = self.special
+			self.special = None
+			self.special_format = None
+			self.special_schema = None
+		else:
+			sheet = self.sheets.pop(name)
+		self._notify('sheet_removed', name, sheet)
 		return sheet
 
+	def rename_sheet(self, name, new_name):
+		"""Renames a sheet, keeping its position."""
+		if isinstance(self.sheets, dict):
+			self.sheets = {new_name if k == name else k: v for k, v in self.sheets.items()}
+		else:
+			self.sheets.rename(name, new_name)
+		self._notify('sheet_renamed', name, new_name)
+
+	def add_listener(self, listener):
+		"""Makes a `DatasetListener` receive every change made through the methods of this dataset."""
+		self.listeners.append(listener)
+
+	def remove_listener(self, listener):
+		self.listeners.remove(listener)
+
+	def begin(self):
+		"""
+		Starts a transaction, which lasts until the matching `commit`. Changes are still applied and reported
+		to listeners right away; the transaction only tells code that follows the dataset (see `in_transaction`)
+		that it may wait for the end of it to update. Calls can be nested.
+		"""
+		self._transaction_depth += 1
+
+	def commit(self):
+		self._transaction_depth -= 1
+
+	@contextlib.contextmanager
+	def transaction(self):
+		self.begin()
+		try:
+			yield
+		finally:
+			self.commit()
+
+	def in_transaction(self):
+		return self._transaction_depth > 0
+
+	def _notify(self, event, *args):
+		for listener in self.listeners:
+			getattr(listener, event)(*args)
+
+	@property
+	def text_index(self):
+		"""An `indexes.TextIndex` of this dataset, built on first use and kept up to date afterwards."""
+		if self._text_index is None:
+			import indexes  # Imports this module
+			self._text_index = indexes.TextIndex(self)
+		return self._text_index
+
+	def search(self, query, mode='value', group=None):
+		"""Returns the names of sheets with text values matching `query`; see `indexes.TextIndex.search`."""
+		return self.text_index.sheets(query, mode, group)
+
+	@property
+	def time_index(self):
+		"""An `indexes.TimeIndex` of this dataset, built on first use and kept up to date afterwards."""
+		if self._time_index is None:
+			import indexes  # Imports this module
+			self._time_index = indexes.TimeIndex(self)
+		return self._time_index
+
+	def between(self, start, end, mode='overlap', group=None):
+		"""Returns the names of sheets with dates in the given range; see `indexes.TimeIndex.search`."""
+		return self.time_index.sheets(start, end, mode, group)
+
 	def format_price(self, value):
 		return f'{self.price_prefix}{round(float(value), 2)}{self.price_suffix}'
 
@@ -186,23 +664,40 @@ class Dataset:
 			raise ValueError(f'Invalid cell ID: {cell_id}')
 		return list(list(sheet.values())[group - 1].values())[cell - 1]
 
+	@tracing.traced('compute_results')
 	def compute_results(self, current_sheet):
+		self.results.update(self.evaluate(current_sheet))
+
+	def evaluate(self, current_sheet, special=None, labels=None, known=None):
+		"""
+		Returns the results of all formulas for `current_sheet` without storing them in `results`.
+		If given, `special` is used instead of the special sheet. If `labels` is given, only those formulas
+		are evaluated, and the others take their results from the dict `known`, e.g. when they're known
+		not to change (see `sweep.dependent_formulas`).
+		"""
+		results = {}
 		for label, formula in self.formulas.items():
+			if labels is not None and label not in labels:
+				results[label] = known[label]
+				continue
 			try:
-				self.results[label] = eval(formula, {
+				results[label] = eval(compile_formula(formula), {
 					'sheets': self.sheets,
 					'current': current_sheet,
-					'special': self.special,
-					'results': self.results,
+					'special': self.special if special is None else special,
+					'results': results,
 					'price': self.format_price,
 					'cell': self.get_cell,
 					'delta': calculate_delta,
+					'search': self.search,
+					'between': self.between,
 					'itertools': itertools,
 					'datetime': datetime
 				})
 			except Exception as e:
-				self.results[label] = type(e).__name__ + ' (see output)'
+				results[label] = type(e).__name__ + ' (see output)'
 				sys.stderr.write(str(e) + '\n')
+		return results
 
 	@staticmethod
 	def remove_format_from_sheet(sheet):
@@ -211,7 +706,8 @@ class Dataset:
 			res.append(list(group_data.values()))
 		return res
 
-	def to_json(self):
+	def header_data(self):
+		"""Returns the raw data of everything but the sheets, as it's written to files."""
 		final_data = {
 			"name": self.name,
 			"format": self.format
@@ -224,16 +720,96 @@ class Dataset:
 		):
 			if k in self._data:
 				final_data[k] = v
-		final_data['sheets'] = {}
+		return final_data
+
+	def iter_raw_sheets(self):
+		"""Yields the raw name and data of every sheet as it's written to files, including the special and default sheets."""
 		for sheet_name, sheet_data in self.sheets.items():
-			final_data['sheets'][sheet_name] = self.remove_format_from_sheet(sheet_data)
+			yield sheet_name, self.remove_format_from_sheet(sheet_data)
 		if self.special:
-			final_data['sheets']['__special__'] = self.remove_format_from_sheet(self.special)
-		if '__default__' in self._data['sheets']:
-			final_data['sheets']['__default__'] = self.remove_format_from_sheet(self.default)
+			yield SPECIAL_SHEET, self.remove_format_from_sheet(self.special)
+		if DEFAULT_SHEET in self._data['sheets']:
+			yield DEFAULT_SHEET, self.remove_format_from_sheet(self.default)
+
+	@tracing.traced('to_json')
+	def to_json(self):
+		final_data = self.header_data()
+		final_data['sheets'] = dict(self.iter_raw_sheets())
 		return json.dumps(final_data, cls=DatasetEncoder, indent=4)
 
 
+class DatasetListener:
+	"""Base class for objects that follow changes made to a dataset; see `Dataset.add_listener`."""
+	def value_changed(self, sheet_name, group_name, value_name, old_value, new_value):
+		pass
+
+	def sheet_added(self, name, sheet):
+		pass
+
+	def sheet_removed(self, name, sheet):
+		pass
+
+	def sheet_renamed(self, name, new_name):
+		pass
+
+
+class DatasetChanges:
+	"""
+	Differences between two versions of a dataset, as found by `diff_datasets`.
+	Sheet names are the same as in `Dataset.get_sheet`, so the special sheet is `SPECIAL_SHEET`.
+	"""
+	def __init__(self):
+		# True if the format or price display changed, in which case the other attributes aren't filled in
+		self.structure_changed = False
+		self.name = None
+		self.formulas = None
+		self.removed = []
+		self.added = []
+		# Sheet name -> names of changed groups
+		self.changed = {}
+		self.order_changed = False
+
+	def __bool__(self):
+		return bool(
+			self.structure_changed or self.name is not None or self.formulas is not None
+			or self.removed or self.added or self.changed or self.order_changed
+		)
+
+
+def diff_datasets(old, new):
+	"""Returns the `DatasetChanges` needed to turn the contents of the dataset `old` into those of `new`."""
+	changes = DatasetChanges()
+	if (
+		(old.format, old.price_prefix, old.price_suffix) != (new.format, new.price_prefix, new.price_suffix)
+		or (old.special is not None and new.special is not None and old.special_format != new.special_format)
+	):
+		changes.structure_changed = True
+		return changes
+	if new.name != old.name:
+		changes.name = new.name
+	if new.formulas != old.formulas:
+		changes.formulas = new.formulas
+	old_names = dict.fromkeys(old.sheets)
+	new_names = dict.fromkeys(new.sheets)
+	if old.special is not None:
+		old_names[SPECIAL_SHEET] = None
+	if new.special is not None:
+		new_names[SPECIAL_SHEET] = None
+	changes.removed = [name for name in old_names if name not in new_names]
+	changes.added = [name for name in new_names if name not in old_names]
+	for name in new_names:
+		if name not in old_names:
+			continue
+		old_sheet = old.get_sheet(name)
+		new_sheet = new.get_sheet(name)
+		group_names = [g for g in new_sheet.unshared_groups(old_sheet) if old_sheet.get(g) != new_sheet[g]]
+		if group_names:
+			changes.changed[name] = group_names
+	common = [name for name in new.sheets if name in old.sheets]
+	changes.order_changed = common != [name for name in old.sheets if name in new.sheets]
+	return changes
+
+
 class DatasetEncoder(json.JSONEncoder):
 	def default(self, o):
 		if isinstance(o, dict):
@@ -241,12 +817,13 @@ class DatasetEncoder(json.JSONEncoder):
 			for k, v in o:
 				new_dict[k] = self.default(v)
 			return super().default(new_dict)
+		# datetime is a subclass of date, so it must be checked first
+		if isinstance(o, datetime.datetime):
+			return o.strftime('%Y-%m-%d %H:%M:%S')
 		if isinstance(o, datetime.date):
-			return o.strftime('%Y-%M-%d')
+			return o.strftime('%Y-%m-%d')
 		if isinstance(o, datetime.time):
 			return o.strftime('%H:%M:%S')
-		if isinstance(o, datetime.datetime):
-			return o.strftime('%Y-%M-%d %H:%M:%S')
 		if isinstance(o, Timedelta):
 			return ''.join(f'{v}{u}' for u, v in o.fmt_values().items())
 		if isinstance(o, datetime.timedelta):
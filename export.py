@@ -0,0 +1,138 @@
+import collections
+import concurrent.futures
+import csv
+import json
+import os
+
+import datasets
+import sharding
+import tracing
+
+
+FORMATS = ('csv', 'jsonl')
+# Sheets evaluated per task when using worker processes
+CHUNK_SIZE = 64
+
+_encoder = datasets.DatasetEncoder()
+# Dataset of a worker process of worker_pool, set by _init_worker
+_worker_dataset = None
+
+
+def columns(dataset, include_results=True):
+	"""Returns the column names of exported rows: the sheet name, every value as "group/value", and every formula."""
+	names = ['sheet']
+	for group_name, group_format in dataset.format.items():
+		names.extend(f'{group_name}/{value_name}' for value_name in group_format)
+	if include_results:
+		names.extend(dataset.formulas)
+	return names
+
+
+def cell(value):
+	"""Converts a value to a plain str, int or float, using the same representation as dataset files."""
+	if value is None or isinstance(value, (str, int, float)):
+		return value
+	try:
+		encoded = _encoder.default(value)
+	except TypeError:
+		return str(value)
+	if isinstance(encoded, list):
+		# Calcdelta
+		return ' - '.join(encoded)
+	return encoded
+
+
+def iter_rows(dataset, sheet_names=None, include_results=True, workers=0):
+	"""
+	Yields one row (a list matching `columns`) per sheet in `sheet_names`, or per sheet in the dataset.
+
+	Rows are produced one at a time, so memory use doesn't depend on the number of sheets. If `workers` is more
+	than 0, formulas are evaluated in that many processes, with only a bounded number of sheets in flight;
+	rows are still yielded in sheet order. Sharded datasets can't be sent to other processes, so their formulas are
+	always evaluated in this one.
+	"""
+	if sheet_names is None:
+		sheet_names = list(dataset.sheets)
+	if not include_results:
+		results = (None for _ in sheet_names)
+	elif workers > 0 and not sharding.is_sharded(dataset):
+		results = _evaluate_in_processes(dataset, sheet_names, workers)
+	else:
+		results = (dataset.evaluate(dataset.sheets[name]) for name in sheet_names)
+	for name, sheet_results in zip(sheet_names, results):
+		row = [name]
+		sheet = dataset.sheets[name]
+		# Raw data may leave out the last values of a sheet; those cells stay empty so that columns line up
+		for group_name, group_format in dataset.format.items():
+			group = sheet.get(group_name, {})
+			row.extend(cell(group.get(value_name)) for value_name in group_format)
+		if sheet_results is not None:
+			row.extend(cell(sheet_results[label]) for label in dataset.formulas)
+		yield row
+
+
+def write_csv(dataset, fp, **kwargs):
+	"""Writes `iter_rows` to a text file as CSV. Keyword arguments are passed to `iter_rows`."""
+	writer = csv.writer(fp)
+	writer.writerow(columns(dataset, kwargs.get('include_results', True)))
+	for row in iter_rows(dataset, **kwargs):
+		writer.writerow(row)
+
+
+def write_jsonl(dataset, fp, **kwargs):
+	"""Writes `iter_rows` to a text file as one JSON object per line. Keyword arguments are passed to `iter_rows`."""
+	names = columns(dataset, kwargs.get('include_results', True))
+	for row in iter_rows(dataset, **kwargs):
+		fp.write(json.dumps(dict(zip(names, row))))
+		fp.write('\n')
+
+
+def export(dataset, path, fmt=None, **kwargs):
+	"""Writes `iter_rows` to `path` in the format `fmt`, or the one matching the file extension."""
+	fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+	if fmt not in FORMATS:
+		raise ValueError(f'Unknown export format: {fmt} (expected one of {", ".join(FORMATS)})')
+	with tracing.span('export', path=str(path), format=fmt), open(path, 'w', newline='') as f:
+		if fmt == 'csv':
+			write_csv(dataset, f, **kwargs)
+		else:
+			write_jsonl(dataset, f, **kwargs)
+
+
+def worker_pool(dataset, workers, mp_context=None):
+	"""
+	Returns a process pool of `workers` processes that each receive `dataset` once, when they start.
+	Functions run in the pool get it from `worker_dataset`. The dataset must not be sharded.
+	`mp_context` is passed to the pool; processes started from threads should use the "spawn" context.
+	"""
+	return concurrent.futures.ProcessPoolExecutor(
+		workers, mp_context=mp_context, initializer=_init_worker, initargs=(dataset,)
+	)
+
+
+def worker_dataset():
+	"""Returns the dataset of the current process of a `worker_pool`."""
+	return _worker_dataset
+
+
+def _init_worker(dataset):
+	global _worker_dataset
+	_worker_dataset = dataset
+
+
+def _evaluate_chunk(sheet_names):
+	dataset = worker_dataset()
+	return [dataset.evaluate(dataset.sheets[name]) for name in sheet_names]
+
+
+def _evaluate_in_processes(dataset, sheet_names, workers):
+	chunks = (sheet_names[i:i + CHUNK_SIZE] for i in range(0, len(sheet_names), CHUNK_SIZE))
+	with worker_pool(dataset, workers) as executor:
+		pending = collections.deque()
+		for chunk in chunks:
+			pending.append(executor.submit(_evaluate_chunk, chunk))
+			# Keep every worker busy, but don't queue up the whole dataset
+			if len(pending) >= workers * 2:
+				yield from pending.popleft().result()
+		while pending:
+			yield from pending.popleft().result()
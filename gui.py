@@ -1,17 +1,32 @@
+import collections
+import contextlib
 import datetime
+import multiprocessing
 import sys
 from pathlib import Path
 
-from PySide2.QtCore import Signal, QDate, QTime, QDateTime, Qt, QSize, QStandardPaths
+from PySide2.QtCore import (
+	Signal, QDate, QTime, QDateTime, Qt, QSize, QStandardPaths, QFileSystemWatcher, QTimer, QThread,
+	QAbstractTableModel, QModelIndex
+)
 from PySide2.QtWidgets import (
-	QMainWindow, QWidget,
+	QApplication, QMainWindow, QWidget, QDialog,
 	QAction,
 	QTabWidget, QLabel, QSpinBox, QDateTimeEdit, QDoubleSpinBox, QLineEdit,
 	QTabBar, QDateEdit, QTimeEdit, QPushButton, QInputDialog, QMessageBox, QFileDialog,
+	QListWidget, QListWidgetItem, QCheckBox, QTableView, QHeaderView, QStyledItemDelegate, QProgressBar,
 	QHBoxLayout, QVBoxLayout, QGridLayout
 )
 from PySide2.QtGui import QKeySequence, QDesktopServices
+import cache
+import compression
 import datasets
+import export
+import history
+import importer
+import sharding
+import sweep
+import tracing
 
 
 class MainWindow(QMainWindow):
@@ -25,6 +40,27 @@ class MainWindow(QMainWindow):
 		self.dataset_view = None
 		self.file_path = None
 		self.edited = False
+		self.dataset_cache = cache.DatasetCache(snapshots=cache.SnapshotCache())
+		# The dataset as it was last read from or written to disk, to find out what other programs changed
+		self.disk_dataset = None
+		self.written_stat = None
+		self.file_watcher = QFileSystemWatcher(self)
+		# Editors may write a file in several steps, so wait until they're done
+		self.file_change_timer = QTimer(self)
+		self.file_change_timer.setSingleShot(True)
+		self.file_change_timer.setInterval(300)
+		self.file_watcher.fileChanged.connect(lambda _: self.file_change_timer.start())
+		self.file_change_timer.timeout.connect(self.on_file_changed)
+		# Datasets are read and decoded in the background; the one being shown stays usable meanwhile
+		self.loader = None
+		self.load_label = QLabel()
+		self.load_progress = QProgressBar()
+		self.load_progress.setMaximumWidth(200)
+		self.load_cancel_button = QPushButton('Cancel')
+		self.load_cancel_button.clicked.connect(self.cancel_load)
+		for widget in (self.load_label, self.load_progress, self.load_cancel_button):
+			self.statusBar().addPermanentWidget(widget)
+			widget.hide()
 
 		# Set up the menu bar
 		file_menu = self.menuBar().addMenu('&File')
@@ -38,6 +74,20 @@ class MainWindow(QMainWindow):
 			action.setShortcut(shortcut)
 			action.triggered.connect(slot)
 			file_menu.addAction(action)
+		file_menu.addSeparator()
+		action = QAction('Import CSV...', self)
+		action.triggered.connect(self.on_import)
+		file_menu.addAction(action)
+		action = QAction('Export...', self)
+		action.triggered.connect(self.on_export)
+		file_menu.addAction(action)
+		action = QAction('What-if sweep...', self)
+		action.triggered.connect(self.on_sweep)
+		file_menu.addAction(action)
+		if tracing.enabled():
+			action = QAction('Save performance trace...', self)
+			action.triggered.connect(self.on_save_trace)
+			file_menu.addAction(action)
 		self.update_title()
 		self.setCentralWidget(QLabel('Press "File" -> "Open" to open a dataset.'))
 
@@ -45,12 +95,81 @@ class MainWindow(QMainWindow):
 		if not self.unsaved_changes_check():
 			event.ignore()
 		else:
+			# Threads must be done before they're destroyed with the window, including canceled ones
+			for loader in self.findChildren(DatasetLoader):
+				loader.cancel()
+				loader.wait()
+			# Snapshots are written by daemon threads, which would be killed halfway and leave their temporary files
+			self.dataset_cache.snapshots.wait()
 			event.accept()
 
-	def init_dataset(self, file_path):
+	def init_dataset(self, file_path, reload=False):
+		"""
+		Starts loading the dataset at `file_path` in the background and shows it once it's loaded.
+		If `reload` is True, the file is the one being shown and changed on disk, so only the changes are
+		applied (see `on_file_reloaded`). Loading another dataset in the meantime cancels this one.
+		"""
+		if self.loader is not None:
+			self.loader.cancel()
+		# A canceled loader may still be parsing while holding the cache's lock; this one waits for it in the background
+		loader = DatasetLoader(self.dataset_cache, Path(file_path), self)
+		loader.progress.connect(self.on_load_progress)
+		if reload:
+			loader.loaded.connect(lambda dataset: self.on_file_reloaded(loader, dataset))
+			loader.failed.connect(lambda message: self.on_reload_failed(loader, message))
+		else:
+			loader.loaded.connect(lambda dataset: self.on_dataset_loaded(loader, dataset))
+			loader.failed.connect(lambda message: self.on_load_failed(loader, message))
+		loader.finished.connect(loader.deleteLater)
+		self.loader = loader
+		self.load_label.setText(f'{"Reloading" if reload else "Loading"} {loader.path.name}...')
+		self.load_progress.setRange(0, 0)
+		for widget in (self.load_label, self.load_progress, self.load_cancel_button):
+			widget.show()
+		loader.start()
+
+	def cancel_load(self):
+		if self.loader is not None:
+			self.loader.cancel()
+			self.loader = None
+		for widget in (self.load_label, self.load_progress, self.load_cancel_button):
+			widget.hide()
+
+	def on_load_progress(self, done, total):
+		# (0, 0) while reading and parsing, which shows a busy indicator
+		self.load_progress.setRange(0, total)
+		self.load_progress.setValue(done)
+
+	def on_dataset_loaded(self, loader, disk_dataset):
+		if loader is not self.loader:
+			# Canceled or replaced by another load
+			return
+		self.cancel_load()
+		self.show_dataset(loader.path, disk_dataset)
+
+	def on_load_failed(self, loader, message):
+		if loader is not self.loader:
+			return
+		self.cancel_load()
+		box = QMessageBox(self)
+		box.setWindowTitle('Open - DatasheetCalculator')
+		box.setText(f'Could not open {loader.path}:\n{message}')
+		box.exec_()
+
+	def show_dataset(self, file_path, disk_dataset):
+		"""Replaces the dataset being shown with a copy of `disk_dataset`, which was loaded from `file_path`."""
 		if not self.file_path:
 			# First time a file was opened this session; add sheet manipulation buttons
 			edit_menu = self.menuBar().addMenu('&Edit')
+			for label, shortcut, slot in (
+				('Undo', QKeySequence.Undo, self.on_undo),
+				('Redo', QKeySequence.Redo, self.on_redo)
+			):
+				action = QAction(label, self)
+				action.setShortcut(shortcut)
+				action.triggered.connect(slot)
+				edit_menu.addAction(action)
+			edit_menu.addSeparator()
 			for label, slot in (
 				('Refresh', self.on_refresh),
 				('Edit dataset directly', self.on_edit_directly),
@@ -71,15 +190,81 @@ class MainWindow(QMainWindow):
 				action.triggered.connect(slot)
 				edit_menu.addAction(action)
 		self.file_path = Path(file_path)
-		with open(self.file_path) as f:
-			json_str = f.read()
-		self.dataset = datasets.Dataset.from_json(json_str)
-		self.dataset_view = DatasetView(self.dataset)
-		self.dataset_view.valueChanged.connect(lambda *_: self.set_edited(True))
-		if self.dataset_view.special_view:
-			self.dataset_view.special_view.valueChanged.connect(lambda *_: self.set_edited(True))
+		self.disk_dataset = disk_dataset
+		self.dataset = disk_dataset.copy()
+		with tracing.span('DatasetView', sheets=len(self.dataset.sheets)):
+			self.dataset_view = DatasetView(self.dataset)
+		self.dataset_view.edited.connect(lambda: self.set_edited(True))
 		self.setCentralWidget(self.dataset_view)
-		self.setWindowTitle(f'{self.dataset.name} - DatasheetCalculator')
+		self.set_edited(False)  # Also updates the title
+		self.watch_file()
+
+	def watch_file(self):
+		if self.file_watcher.files():
+			self.file_watcher.removePaths(self.file_watcher.files())
+		self.file_watcher.addPath(str(self.file_path))
+
+	@tracing.traced('write dataset')
+	def write_dataset(self, file_path):
+		if sharding.is_sharded(self.dataset):
+			# Only the manifest and the shards that changed are written
+			sharding.save(self.dataset, file_path)
+		else:
+			compression.save(self.dataset, file_path)
+		stat = Path(file_path).stat()
+		self.written_stat = (stat.st_mtime_ns, stat.st_size)
+		self.disk_dataset = self.dataset.copy()
+
+	def on_file_changed(self):
+		if self.loader is not None:
+			# Another dataset is being opened, or this one is being reloaded anyway
+			return
+		try:
+			stat = self.file_path.stat()
+		except OSError:
+			# Editors that save by replacing the file may not have put the new one in place yet
+			self.file_change_timer.start()
+			return
+		if str(self.file_path) not in self.file_watcher.files():
+			# Replacing the file makes the watcher forget about it
+			self.file_watcher.addPath(str(self.file_path))
+		if (stat.st_mtime_ns, stat.st_size) == self.written_stat:
+			return
+		self.init_dataset(self.file_path, reload=True)
+
+	def on_reload_failed(self, loader, message):
+		if loader is not self.loader:
+			return
+		self.cancel_load()
+		# Probably saved in the middle of editing; wait for the next change
+		sys.stderr.write(f'Not reloading {loader.path}: {message}\n')
+
+	def on_file_reloaded(self, loader, new_dataset):
+		if loader is not self.loader:
+			return
+		self.cancel_load()
+		if sharding.is_sharded(new_dataset):
+			# Comparing would read every shard, so reload the whole dataset instead
+			changes = None
+		else:
+			changes = datasets.diff_datasets(self.disk_dataset, new_dataset)
+			if not changes:
+				return
+		if self.edited:
+			box = QMessageBox(self)
+			box.setWindowTitle('DatasheetCalculator')
+			box.setText('The dataset was changed by another program.')
+			box.setInformativeText('Load the changes? Unsaved edits to the changed sheets will be lost.')
+			box.setStandardButtons(QMessageBox.No | QMessageBox.Yes)
+			box.setDefaultButton(QMessageBox.Yes)
+			if box.exec_() == QMessageBox.No:
+				return
+		if changes is None or changes.structure_changed:
+			self.show_dataset(self.file_path, new_dataset)
+		else:
+			self.disk_dataset = new_dataset
+			self.dataset_view.apply_changes(new_dataset, changes)
+			self.update_title()
 
 	def update_title(self):
 		if self.dataset:
@@ -116,7 +301,7 @@ class MainWindow(QMainWindow):
 			return
 		file_path = QFileDialog.getOpenFileName(
 			self, 'Open dataset', self.get_file_dialog_directory(),
-			'Datasets (*.json);;All files (*.*)'
+			compression.OPEN_FILTER
 		)[0]
 		if file_path:
 			self.init_dataset(file_path)
@@ -124,23 +309,95 @@ class MainWindow(QMainWindow):
 	def on_save(self):
 		if not (self.file_path and self.dataset):
 			return
-		with open(self.file_path, 'w') as f:
-			f.write(self.dataset.to_json())
+		self.write_dataset(self.file_path)
 		self.set_edited(False)
 
 	def on_save_as(self):
 		if not self.dataset:
 			return
-		file_path = QFileDialog.getSaveFileName(
+		file_path, selected_filter = QFileDialog.getSaveFileName(
 			self, 'Open dataset', self.get_file_dialog_directory(),
-			'Datasets (*.json);;All files (*.*)'
-		)[0]
+			compression.SAVE_FILTER
+		)
+		if file_path and not file_path.endswith(compression.SUFFIXES):
+			# Use the suffix of the selected type, which decides the compression
+			file_path += selected_filter[selected_filter.index('*') + 1:-1]
 		if file_path:
-			with open(file_path, 'w') as f:
-				f.write(self.dataset.to_json())
+			self.write_dataset(file_path)
 			self.file_path = Path(file_path)
+			self.watch_file()
 		self.set_edited(False)
 
+	def on_import(self):
+		if not self.dataset:
+			return
+		file_path = QFileDialog.getOpenFileName(
+			self, 'Import sheets', self.get_file_dialog_directory(),
+			'CSV (*.csv);;All files (*.*)'
+		)[0]
+		if not file_path:
+			return
+		error = None
+		QApplication.setOverrideCursor(Qt.WaitCursor)
+		try:
+			self.dataset_view.import_csv(file_path)
+		except (OSError, ValueError) as e:
+			error = e
+		finally:
+			QApplication.restoreOverrideCursor()
+		if error is not None:
+			box = QMessageBox(self)
+			box.setWindowTitle('Import - DatasheetCalculator')
+			box.setText(f'Could not import {file_path}:\n{error}')
+			box.exec_()
+
+	def on_export(self):
+		if not self.dataset:
+			return
+		file_path, selected_filter = QFileDialog.getSaveFileName(
+			self, 'Export sheets', self.get_file_dialog_directory(),
+			'CSV (*.csv);;JSON Lines (*.jsonl)'
+		)
+		if not file_path:
+			return
+		fmt = 'jsonl' if selected_filter.startswith('JSON') else 'csv'
+		if not Path(file_path).suffix:
+			file_path += f'.{fmt}'
+		error = None
+		QApplication.setOverrideCursor(Qt.WaitCursor)
+		try:
+			export.export(self.dataset, file_path, fmt)
+		except (OSError, ValueError) as e:
+			error = e
+		finally:
+			QApplication.restoreOverrideCursor()
+		if error is not None:
+			box = QMessageBox(self)
+			box.setWindowTitle('Export - DatasheetCalculator')
+			box.setText(f'Could not export to {file_path}:\n{error}')
+			box.exec_()
+
+	def on_sweep(self):
+		if not self.dataset:
+			return
+		if not self.dataset.special:
+			box = QMessageBox(self)
+			box.setWindowTitle('What-if sweep - DatasheetCalculator')
+			box.setText('Sweeps try out values of the special sheet, but this dataset has none.')
+			box.exec_()
+			return
+		current = None if self.dataset_view.special_selected() else self.dataset_view.current_sheet_name()
+		# The sweep runs in the background, so give it a copy that edits can't change in the meantime
+		SweepDialog(self.dataset.copy(), current, self).exec_()
+
+	def on_save_trace(self):
+		file_path = QFileDialog.getSaveFileName(
+			self, 'Save performance trace', self.get_file_dialog_directory(),
+			'Chrome trace (*.json);;All files (*.*)'
+		)[0]
+		if file_path:
+			tracing.dump(file_path)
+
 	def on_refresh(self):
 		if not self.unsaved_changes_check():
 			return
@@ -151,6 +408,14 @@ class MainWindow(QMainWindow):
 			return
 		QDesktopServices.openUrl(self.file_path.absolute().as_uri())
 
+	def on_undo(self):
+		if self.dataset_view and self.dataset_view.undo():
+			self.set_edited(True)
+
+	def on_redo(self):
+		if self.dataset_view and self.dataset_view.redo():
+			self.set_edited(True)
+
 	def on_rename_dataset(self):
 		self.dataset_view.user_rename_dataset()
 		self.set_edited(True)  # Also updates the title
@@ -173,38 +438,85 @@ class MainWindow(QMainWindow):
 		return True
 
 
+class LoadCanceled(Exception):
+	pass
+
+
+class DatasetLoader(QThread):
+	"""
+	Loads a dataset through a `cache.DatasetCache` in a background thread. Canceling takes effect at the next
+	progress report, so a file that's still being parsed is only abandoned once parsing is done.
+	"""
+	progress = Signal(int, int)  # sheets decoded, total sheets
+	loaded = Signal(object)
+	failed = Signal(str)
+
+	def __init__(self, dataset_cache, path, parent=None):
+		super().__init__(parent)
+		self.dataset_cache = dataset_cache
+		self.path = path
+		self.canceled = False
+
+	def cancel(self):
+		self.canceled = True
+
+	def run(self):
+		try:
+			with tracing.span('load dataset', path=str(self.path)):
+				dataset = self.dataset_cache.load(self.path, progress=self.report)
+		except LoadCanceled:
+			return
+		except Exception as e:
+			# Valid JSON may still not be a dataset (e.g. a list, or missing values), which fails in many ways.
+			# Either way, the window must hear about it to stop waiting for this loader.
+			self.failed.emit(f'{type(e).__name__}: {e}')
+			return
+		if not self.canceled:
+			self.loaded.emit(dataset)
+
+	def report(self, done, total):
+		if self.canceled:
+			raise LoadCanceled
+		self.progress.emit(done, total)
+
+
 class DatasetView(QWidget):
 	SPECIAL_SHEET_NAME = '[Global values]'
+	# Sheet tabs added per iteration of the event loop; tab bars with thousands of tabs take seconds to fill
+	TAB_CHUNK_SIZE = 500
 	valueChanged = Signal(str, str, str, object)  # sheet, group, value name, value
+	# Emitted once per value edited in the widgets, or once per transaction that changed something
+	edited = Signal()
 
 	def __init__(self, dataset, parent=None):
 		super().__init__(parent)
 		self.dataset = dataset
+		self.history = history.History(dataset)
 		self.tab_bar = QTabBar()
 		self.sheet_view = SingleSheetView(
 			next(iter(self.dataset.sheets.values()), None),
 			self.dataset.price_prefix,
 			self.dataset.price_suffix
 		)
-		if self.dataset.special:
-			self.special_view = SingleSheetView(
-				self.dataset.special,
-				self.dataset.price_prefix,
-				self.dataset.price_suffix
-			)
-		else:
-			self.special_view = None
+		self.special_view = self.make_special_view() if self.dataset.special else None
 		self.name_label = QLabel(dataset.name)
 		self.formula_view = FormulaView(dataset)
 		self.extra_buttons = ExtraButtons()
+		self.search_view = SearchView(dataset)
+		self.date_filter = DateFilterView()
 
 		self.sheet_view.valueChanged.connect(lambda g, n, v: self.valueChanged.emit(
 			self.current_sheet_name(), g, n, v
 		))
 		if self.dataset.special:
 			self.tab_bar.addTab(self.SPECIAL_SHEET_NAME)
-		for sheet_name in self.dataset.sheets.keys():
-			self.tab_bar.addTab(sheet_name)
+		# The first tabs are added right away and the rest while the window is already usable.
+		# Anything that needs tab indices of all sheets calls finish_tabs() first.
+		self.unstaged_tabs = collections.deque(self.dataset.sheets.keys())
+		self.tab_timer = QTimer(self)
+		self.tab_timer.setInterval(0)
+		self.tab_timer.timeout.connect(self.add_tab_chunk)
+		self.add_tab_chunk()
 
 		layout = QVBoxLayout()
 		layout.addWidget(self.name_label)
@@ -215,6 +527,13 @@ class DatasetView(QWidget):
 		layout.addWidget(self.sheet_view)
 		if self.dataset.special:
 			self.sheet_view.hide()
+		layout.addWidget(self.search_view)
+		layout.addWidget(self.date_filter)
+		if not any(
+			value_type in ('date', 'datetime', 'calcdelta_d', 'calcdelta_dt')
+			for group in self.dataset.format.values() for value_type in group.values()
+		):
+			self.date_filter.hide()
 		layout.addWidget(self.tab_bar)
 		# The functionality of extra buttons is now in the menu bar
 		# Keeping the definitions just in case
@@ -223,6 +542,8 @@ class DatasetView(QWidget):
 		self.tab_bar.currentChanged.connect(self.recompute)
 		self.tab_bar.currentChanged.connect(self.update_views)
 		self.valueChanged.connect(self.update_dataset)
+		self.search_view.resultSelected.connect(self.show_value)
+		self.date_filter.filterChanged.connect(self.apply_date_filter)
 		self.extra_buttons.createSheet.connect(self.create_blank_sheet)
 		self.extra_buttons.duplicateSheet.connect(lambda: self.duplicate_sheet(
 			self.current_index()
@@ -230,15 +551,202 @@ class DatasetView(QWidget):
 		self.extra_buttons.renameSheet.connect(self.user_rename_sheet)
 		self.update_views()
 
+	def add_tab_chunk(self):
+		with tracing.span('add tabs', count=min(len(self.unstaged_tabs), self.TAB_CHUNK_SIZE)):
+			for _ in range(min(len(self.unstaged_tabs), self.TAB_CHUNK_SIZE)):
+				self.tab_bar.addTab(self.unstaged_tabs.popleft())
+		if self.unstaged_tabs:
+			self.tab_timer.start()
+		else:
+			self.tab_timer.stop()
+
+	def finish_tabs(self):
+		"""Adds the tabs of sheets that weren't added yet, so that there's a tab for every sheet."""
+		self.tab_timer.stop()
+		while self.unstaged_tabs:
+			self.tab_bar.addTab(self.unstaged_tabs.popleft())
+
+	def make_special_view(self):
+		view = SingleSheetView(
+			self.dataset.special,
+			self.dataset.price_prefix,
+			self.dataset.price_suffix
+		)
+		view.valueChanged.connect(lambda g, n, v: self.valueChanged.emit(datasets.SPECIAL_SHEET, g, n, v))
+		return view
+
 	def update_dataset(self, sheet, group, name, value, recompute=True):
-		self.dataset.sheets[sheet][group][name] = value
+		self.history.set_value(sheet, group, name, value)
+		if self.dataset.in_transaction():
+			# Everything is updated once by commit()
+			return
 		if recompute:
 			self.recompute()
+		self.search_view.update_results()
+		self.apply_date_filter()
+		self.edited.emit()
+
+	def begin(self, description='Edit'):
+		"""
+		Starts a transaction: changes made until the matching `commit`, through this view or its `history`,
+		are one undoable step, and the views, formula results and edited state are only updated at the end.
+		Calls can be nested.
+		"""
+		self.dataset.begin()
+		self.history.begin(description)
+
+	def commit(self):
+		"""Ends a transaction. Returns True if it was the outermost one and changed something."""
+		# Changes in a view transaction are made through the history, so its step holds every one of them
+		changed = self.history.commit()
+		self.dataset.commit()
+		if changed:
+			self.sync_with_dataset()
+			self.edited.emit()
+		return changed
+
+	@contextlib.contextmanager
+	def transaction(self, description='Edit'):
+		self.begin(description)
+		try:
+			yield
+		finally:
+			self.commit()
+
+	def set_value(self, sheet, group, name, value):
+		"""Changes a value as if it was edited in the widgets; in a transaction, this only updates the dataset."""
+		self.update_dataset(sheet, group, name, value)
+		if not self.dataset.in_transaction() and sheet in (self.current_sheet_name(), datasets.SPECIAL_SHEET):
+			self.update_views()
+
+	@contextlib.contextmanager
+	def signals_blocked(self):
+		"""Loads values into the value widgets without them reporting edits."""
+		views = [view for view in (self.sheet_view, self.special_view) if view]
+		blocked = [view.blockSignals(True) for view in views]
+		try:
+			yield
+		finally:
+			for view, was_blocked in zip(views, blocked):
+				view.blockSignals(was_blocked)
+
+	def undo(self):
+		"""Returns False if there was nothing to undo."""
+		if self.history.undo() is None:
+			return False
+		self.sync_with_dataset()
+		return True
+
+	def redo(self):
+		"""Returns False if there was nothing to redo."""
+		if self.history.redo() is None:
+			return False
+		self.sync_with_dataset()
+		return True
+
+	def sync_with_dataset(self):
+		"""Updates the tabs and displayed values after the dataset was changed other than through this view."""
+		# The dataset may not match the tabs anymore, so don't go through current_sheet_name()
+		current_name = self.tab_bar.tabText(self.tab_bar.currentIndex())
+		if self.dataset.special and not self.special_view:
+			self.special_view = self.make_special_view()
+			self.special_view.hide()
+			self.layout().insertWidget(self.layout().indexOf(self.sheet_view), self.special_view)
+		elif self.special_view and not self.dataset.special:
+			self.special_view.hide()
+			self.special_view.deleteLater()
+			self.special_view = None
+			self.sheet_view.show()
+		tab_names = ([self.SPECIAL_SHEET_NAME] if self.dataset.special else []) + list(self.dataset.sheets)
+		self.sync_tabs(tab_names, current_name)
+		if self.special_view:
+			with self.signals_blocked():
+				self.special_view.set_value(self.dataset.special)
+		self.update_views()
+		self.recompute()
+		self.search_view.update_results()
+		self.apply_date_filter()
+
+	def sync_tabs(self, tab_names, current_name):
+		self.finish_tabs()
+		tabs = [self.tab_bar.tabText(i) for i in range(self.tab_bar.count())]
+		if tab_names == tabs:
+			return
+		self.tab_bar.blockSignals(True)
+		wanted = set(tab_names)
+		for i in reversed(range(len(tabs))):
+			if tabs[i] not in wanted:
+				self.tab_bar.removeTab(i)
+				del tabs[i]
+		remaining = set(tabs)
+		if [name for name in tab_names if name in remaining] == tabs:
+			# Only additions are left
+			for i, name in enumerate(tab_names):
+				if i >= len(tabs) or tabs[i] != name:
+					self.tab_bar.insertTab(i, name)
+					tabs.insert(i, name)
+		else:
+			# The order changed
+			for name in tab_names[len(tabs):]:
+				self.tab_bar.addTab(name)
+			for i, name in enumerate(tab_names):
+				self.tab_bar.setTabText(i, name)
+		if current_name in wanted:
+			self.tab_bar.setCurrentIndex(tab_names.index(current_name))
+		self.tab_bar.blockSignals(False)
+
+	def apply_changes(self, new_dataset, changes):
+		"""
+		Copies the parts of `new_dataset` listed in `changes` (see `datasets.diff_datasets`) into the dataset
+		as a single undoable step, then updates only the affected widgets.
+		"""
+		with self.history.group('Load changes from disk'):
+			for name in changes.removed:
+				if self.dataset.has_sheet(name):
+					self.history.remove_sheet(name)
+			for name, group_names in changes.changed.items():
+				if not self.dataset.has_sheet(name):
+					continue
+				sheet = self.dataset.get_sheet(name).copy()
+				new_sheet = new_dataset.get_sheet(name)
+				for group_name in group_names:
+					sheet.set_group(group_name, new_sheet[group_name])
+				self.history.replace_sheet(name, sheet)
+			for name in changes.added:
+				sheet = new_dataset.get_sheet(name).copy()
+				if self.dataset.has_sheet(name):
+					self.history.replace_sheet(name, sheet)
+				else:
+					self.history.insert_sheet(
+						name, sheet, new_dataset.sheet_index(name), special_format=new_dataset.special_format
+					)
+			if changes.order_changed:
+				# Sheets that were only added here stay at the end
+				order = [name for name in new_dataset.sheets if name in self.dataset.sheets]
+				order += [name for name in self.dataset.sheets if name not in new_dataset.sheets]
+				self.history.reorder_sheets(order)
+		if changes.name is not None:
+			self.rename_dataset(changes.name)
+		if changes.formulas is not None:
+			self.dataset.formulas = dict(changes.formulas)
+			self.dataset.results = {k: None for k in self.dataset.formulas}
+			formula_view = FormulaView(self.dataset)
+			self.layout().replaceWidget(self.formula_view, formula_view)
+			self.formula_view.deleteLater()
+			self.formula_view = formula_view
+		self.sync_with_dataset()
+
+	def import_csv(self, path):
+		"""Adds a sheet per row of a CSV file (see `importer.read_sheets`) as one undoable step and returns their names."""
+		# Tabs are added and formulas recomputed once for the whole import
+		with self.transaction(f'Import {Path(path).name}'):
+			return importer.import_csv(self.dataset, path, self.history)
 
 	def rename_dataset(self, name):
 		self.dataset.name = name
 		self.name_label.setText(self.dataset.name)
 
+	@tracing.traced('recompute')
 	def recompute(self):
 		if not self.special_selected():
 			self.dataset.compute_results(self.current_sheet())
@@ -246,7 +754,9 @@ class DatasetView(QWidget):
 
 	def update_views(self):
 		if not self.special_selected():
-			self.sheet_view.set_value(self.current_sheet())
+			# Loading values into the widgets isn't an edit
+			with self.signals_blocked():
+				self.sheet_view.set_value(self.current_sheet())
 			if self.special_view:
 				self.special_view.hide()
 				self.sheet_view.show()
@@ -277,7 +787,8 @@ class DatasetView(QWidget):
 
 	def sheet_at(self, index):
 		if index >= 0:
-			return list(self.dataset.sheets.values())[index]
+			# Go through the name, as the sheets of a sharded dataset are only loaded when accessed
+			return self.dataset.sheets[self.sheet_name_at(index)]
 		elif index == -1:
 			return self.dataset.special
 
@@ -287,8 +798,26 @@ class DatasetView(QWidget):
 		elif index == -1:
 			return self.SPECIAL_SHEET_NAME
 
+	def apply_date_filter(self):
+		"""Hides the tabs of sheets without dates in the range selected in the date filter, if it's enabled."""
+		date_range = self.date_filter.date_range()
+		if date_range is None and self.date_filter.all_visible:
+			return
+		self.finish_tabs()
+		visible = set(self.dataset.between(*date_range)) if date_range else self.dataset.sheets
+		offset = bool(self.dataset.special)
+		for i, name in enumerate(self.dataset.sheets):
+			self.tab_bar.setTabVisible(i + offset, name in visible)
+		self.date_filter.all_visible = date_range is None
+
+	def show_value(self, sheet_name, group_name):
+		self.finish_tabs()
+		self.tab_bar.setCurrentIndex(self.dataset.sheet_index(sheet_name) + bool(self.dataset.special))
+		self.sheet_view.setCurrentIndex(list(self.dataset.format).index(group_name))
+
 	def set_current_sheet(self, index):
 		# Negative indices are supported
+		self.finish_tabs()
 		index = index % (self.tab_bar.count() - 1)
 		if self.dataset.special:
 			self.tab_bar.setCurrentIndex(index + 1)
@@ -310,12 +839,14 @@ class DatasetView(QWidget):
 
 	def create_sheet(self, name, switch=True, exist_ok=True):
 		name = self.find_non_duplicate_name(name, exist_ok)
-		self.dataset.sheets[name] = self.dataset.default.copy()
+		self.finish_tabs()
+		self.history.insert_sheet(name, self.dataset.default.copy())
 		self.tab_bar.addTab(name)
 		if switch:
 			self.set_current_sheet(-1)
 
 	def create_blank_sheet(self):
+		self.finish_tabs()
 		self.create_sheet(f'Sheet {self.tab_bar.count() + 1 - bool(self.dataset.special)}')
 
 	def duplicate_sheet(self, index, switch=True, exist_ok=True):
@@ -329,12 +860,14 @@ class DatasetView(QWidget):
 		sheet = self.sheet_at(index)
 		name += ' (copy)'
 		name = self.find_non_duplicate_name(name, exist_ok)
-		self.dataset.sheets[name] = sheet.copy()
+		self.finish_tabs()
+		self.history.insert_sheet(name, sheet.copy(), description=f'Duplicate {self.sheet_name_at(index)}')
 		self.tab_bar.addTab(name)
 		if switch:
 			self.set_current_sheet(-1)
 
 	def delete_sheet(self, index):
+		self.finish_tabs()
 		if index == -1:
 			# Assume a valid state, i.e. there is a special sheet
 			box = QMessageBox(self)
@@ -350,8 +883,7 @@ class DatasetView(QWidget):
 			self.special_view.hide()
 			self.special_view.deleteLater()
 			self.special_view = None
-			self.dataset.special = None
-			self.dataset.special_format = None
+			self.history.remove_sheet(datasets.SPECIAL_SHEET)
 			self.sheet_view.show()
 		else:
 			if len(self.dataset.sheets) < 2:
@@ -364,7 +896,7 @@ class DatasetView(QWidget):
 				self.set_current_sheet(index + 1)
 			except IndexError:
 				self.set_current_sheet(index - 1)
-			del self.dataset.sheets[self.sheet_name_at(index)]
+			self.history.remove_sheet(self.sheet_name_at(index))
 			if self.dataset.special:
 				self.tab_bar.removeTab(index + 1)
 			else:
@@ -393,12 +925,92 @@ class DatasetView(QWidget):
 	def rename_sheet(self, index, result, exist_ok=True):
 		if index == -1:
 			return
-		new_sheets = list(self.dataset.sheets.items())
-		previous, sheet = new_sheets[index]
+		previous = self.sheet_name_at(index)
 		result = self.find_non_duplicate_name(result, exist_ok)
-		self.tab_bar.setTabText(index + 1, result)
-		new_sheets[index] = (result, sheet)
-		self.dataset.sheets = dict(new_sheets)
+		self.finish_tabs()
+		self.tab_bar.setTabText(index + bool(self.dataset.special), result)
+		self.history.rename_sheet(previous, result)
+
+
+class SearchView(QWidget):
+	resultSelected = Signal(str, str)  # sheet, group
+	RESULT_LIMIT = 200
+
+	def __init__(self, dataset, parent=None):
+		super().__init__(parent)
+		self.dataset = dataset
+		self.line_edit = QLineEdit()
+		self.line_edit.setPlaceholderText('Search text values...')
+		self.line_edit.setClearButtonEnabled(True)
+		self.results = QListWidget()
+		self.results.hide()
+
+		layout = QVBoxLayout()
+		layout.setContentsMargins(0, 0, 0, 0)
+		layout.addWidget(self.line_edit)
+		layout.addWidget(self.results)
+		self.setLayout(layout)
+		self.line_edit.textChanged.connect(self.update_results)
+		self.results.itemActivated.connect(self.on_item_selected)
+		self.results.itemClicked.connect(self.on_item_selected)
+
+	def on_item_selected(self, item):
+		position = item.data(Qt.UserRole)
+		if position:
+			self.resultSelected.emit(*position)
+
+	def update_results(self):
+		self.results.clear()
+		query = self.line_edit.text()
+		if not query.strip():
+			self.results.hide()
+			return
+		positions = self.dataset.text_index.search(query, 'prefix')
+		order = {name: i for i, name in enumerate(self.dataset.sheets)}
+		positions = sorted(positions, key=lambda p: (order[p[0]], p[1], p[2]))
+		for sheet_name, group_name, value_name in positions[:self.RESULT_LIMIT]:
+			text = self.dataset.sheets[sheet_name][group_name][value_name]
+			item = QListWidgetItem(f'{sheet_name} - {group_name} - {value_name}: {text}')
+			item.setData(Qt.UserRole, (sheet_name, group_name))
+			self.results.addItem(item)
+		if len(positions) > self.RESULT_LIMIT:
+			self.results.addItem(f'... and {len(positions) - self.RESULT_LIMIT} more')
+		self.results.setVisible(bool(positions))
+
+
+class DateFilterView(QWidget):
+	filterChanged = Signal()
+
+	def __init__(self, parent=None):
+		super().__init__(parent)
+		# Whether the last filter applied showed every sheet
+		self.all_visible = True
+		self.checkbox = QCheckBox('Only show sheets with dates from')
+		self.start_edit = QDateEdit(QDate.currentDate().addMonths(-3))
+		self.end_edit = QDateEdit(QDate.currentDate())
+		for edit in (self.start_edit, self.end_edit):
+			edit.setDisplayFormat('yyyy-MM-dd')
+			edit.setCalendarPopup(True)
+			edit.setEnabled(False)
+			edit.dateChanged.connect(lambda _: self.filterChanged.emit())
+
+		layout = QHBoxLayout()
+		layout.setContentsMargins(0, 0, 0, 0)
+		layout.addWidget(self.checkbox)
+		layout.addWidget(self.start_edit)
+		layout.addWidget(QLabel('to'))
+		layout.addWidget(self.end_edit)
+		layout.addStretch()
+		self.setLayout(layout)
+		self.checkbox.toggled.connect(self.start_edit.setEnabled)
+		self.checkbox.toggled.connect(self.end_edit.setEnabled)
+		self.checkbox.toggled.connect(lambda _: self.filterChanged.emit())
+
+	def date_range(self):
+		"""Returns the selected (start, end) dates, or None if the filter is disabled."""
+		if not self.checkbox.isChecked():
+			return None
+		return self.start_edit.date().toPython(), self.end_edit.date().toPython()
 
 
 class ExtraButtons(QWidget):
@@ -432,32 +1044,282 @@ class FormulaView(QWidget):
 		super().__init__(parent)
 		self.dataset = dataset
 		if self.dataset.sheets:
-			self.dataset.compute_results(list(self.dataset.sheets.values())[0])
+			self.dataset.compute_results(next(iter(self.dataset.sheets.values())))
 		layout = QGridLayout()
 		for name, result in self.dataset.results.items():
 			layout.addWidget(QLabel(f'{name}: {result}'))
 		self.setLayout(layout)
 
+	@tracing.traced('FormulaView.update')
 	def update(self):
 		for i, (name, result) in enumerate(self.dataset.results.items()):
 			self.layout().itemAt(i).widget().setText(f'{name}: {result}')
 
 
+class SweepCanceled(Exception):
+	pass
+
+
+class SweepRunner(QThread):
+	"""
+	Runs `sweep.sweep` in a background thread. Canceling takes effect at the next progress report, i.e. after
+	at most `sweep.CHUNK_SIZE` more evaluations per worker.
+	"""
+	progress = Signal(int, int)  # evaluations done, total evaluations
+	done = Signal(object)  # sweep.SweepResult
+	failed = Signal(str)
+
+	def __init__(self, dataset, parameters, sheet_names, workers, parent=None):
+		super().__init__(parent)
+		self.dataset = dataset
+		self.parameters = parameters
+		self.sheet_names = sheet_names
+		self.workers = workers
+		self.canceled = False
+
+	def cancel(self):
+		self.canceled = True
+
+	def run(self):
+		try:
+			# Forking a process that runs Qt threads can leave locks held in the child forever
+			result = sweep.sweep(
+				self.dataset, self.parameters, self.sheet_names, self.workers,
+				multiprocessing.get_context('spawn'), self.report
+			)
+		except SweepCanceled:
+			return
+		except (OSError, ValueError) as e:
+			self.failed.emit(str(e))
+			return
+		except Exception as e:
+			# E.g. a formula that fails in an unexpected way, or a worker process that died
+			self.failed.emit(f'{type(e).__name__}: {e}')
+			return
+		if not self.canceled:
+			self.done.emit(result)
+
+	def report(self, done, total):
+		if self.canceled:
+			raise SweepCanceled
+		self.progress.emit(done, total)
+
+
+class SweepDialog(QDialog):
+	"""
+	Evaluates the formulas for every combination of values entered for chosen special values,
+	for the current sheet or all sheets, and shows the results in a table that can be exported.
+	"""
+	def __init__(self, dataset, current_sheet_name=None, parent=None):
+		super().__init__(parent)
+		self.setWindowTitle('What-if sweep - DatasheetCalculator')
+		self.dataset = dataset
+		self.current_sheet_name = current_sheet_name
+		self.sweep_result = None
+		self.runner = None
+		# (group name, value name) -> (value type, check box, line edit)
+		self.inputs = {}
+
+		parameter_layout = QGridLayout()
+		for group_name, group_format in dataset.special_format.items():
+			for value_name, value_type in group_format.items():
+				check_box = QCheckBox(f'{group_name} / {value_name}')
+				line_edit = QLineEdit()
+				current = export.cell(dataset.special[group_name][value_name])
+				if value_type in sweep.NUMERIC_TYPES:
+					line_edit.setPlaceholderText(f'Currently {current}; e.g. "{current}, 20" or "10:20:0.5"')
+				else:
+					line_edit.setPlaceholderText(f'Currently {current}; separate values with commas')
+				line_edit.setEnabled(False)
+				check_box.toggled.connect(line_edit.setEnabled)
+				row = parameter_layout.rowCount()
+				parameter_layout.addWidget(check_box, row, 0)
+				parameter_layout.addWidget(line_edit, row, 1)
+				self.inputs[group_name, value_name] = (value_type, check_box, line_edit)
+		self.all_sheets = QCheckBox('All sheets')
+		self.all_sheets.setChecked(current_sheet_name is None)
+		self.all_sheets.setEnabled(current_sheet_name is not None)
+		self.workers = QSpinBox()
+		self.workers.setRange(0, 64)
+		self.workers.setPrefix('Worker processes: ')
+		self.workers.setSpecialValueText('Worker processes: none')
+		self.run_button = QPushButton('Run')
+		self.run_button.clicked.connect(self.on_run)
+		self.cancel_button = QPushButton('Cancel')
+		self.cancel_button.setEnabled(False)
+		self.cancel_button.clicked.connect(self.cancel_run)
+		self.export_button = QPushButton('Export CSV...')
+		self.export_button.setEnabled(False)
+		self.export_button.clicked.connect(self.on_export)
+		self.status_label = QLabel()
+		self.table = QTableView()
+		self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+
+		button_layout = QHBoxLayout()
+		button_layout.addWidget(self.all_sheets)
+		button_layout.addWidget(self.workers)
+		button_layout.addStretch()
+		button_layout.addWidget(self.run_button)
+		button_layout.addWidget(self.cancel_button)
+		button_layout.addWidget(self.export_button)
+		layout = QVBoxLayout()
+		layout.addLayout(parameter_layout)
+		layout.addLayout(button_layout)
+		layout.addWidget(self.status_label)
+		layout.addWidget(self.table)
+		self.setLayout(layout)
+		self.resize(800, 600)
+
+	def parameters(self):
+		"""Returns the values to try for every checked special value; raises ValueError if some can't be read."""
+		parameters = {}
+		for (group_name, value_name), (value_type, check_box, line_edit) in self.inputs.items():
+			if not check_box.isChecked():
+				continue
+			try:
+				parameters[group_name, value_name] = sweep.parse_values(line_edit.text(), value_type)
+			except (ValueError, TypeError) as e:
+				raise ValueError(f'{group_name} / {value_name}: {e}') from None
+		if not parameters:
+			raise ValueError('Check at least one value to try out.')
+		return parameters
+
+	def on_run(self):
+		try:
+			parameters = self.parameters()
+		except ValueError as e:
+			box = QMessageBox(self)
+			box.setWindowTitle('What-if sweep - DatasheetCalculator')
+			box.setText(str(e))
+			box.exec_()
+			return
+		sheet_names = None if self.all_sheets.isChecked() else [self.current_sheet_name]
+		self.runner = SweepRunner(self.dataset, parameters, sheet_names, self.workers.value(), self)
+		self.runner.progress.connect(self.on_progress)
+		self.runner.done.connect(self.on_done)
+		self.runner.failed.connect(self.on_failed)
+		self.runner.finished.connect(self.on_finished)
+		self.run_button.setEnabled(False)
+		self.cancel_button.setEnabled(True)
+		self.status_label.setText('Evaluating...')
+		self.runner.start()
+
+	def cancel_run(self):
+		if self.runner is not None:
+			self.runner.cancel()
+			self.cancel_button.setEnabled(False)
+			self.status_label.setText('Canceling...')
+
+	def on_progress(self, done, total):
+		self.status_label.setText(f'Evaluating... {done} of {total}')
+
+	def on_finished(self):
+		if self.runner.canceled:
+			self.status_label.setText('Canceled')
+		self.run_button.setEnabled(True)
+		self.cancel_button.setEnabled(False)
+
+	def on_done(self, result):
+		self.sweep_result = result
+		self.table.setModel(SweepResultModel(result, self.dataset, self.table))
+		self.export_button.setEnabled(True)
+		self.status_label.setText(f'{len(result.rows)} results')
+
+	def on_failed(self, message):
+		self.status_label.setText(message)
+
+	def on_export(self):
+		file_path = QFileDialog.getSaveFileName(self, 'Export sweep results', '', 'CSV (*.csv)')[0]
+		if not file_path:
+			return
+		if not Path(file_path).suffix:
+			file_path += '.csv'
+		with open(file_path, 'w', newline='') as f:
+			self.sweep_result.write_csv(f)
+
+	def done(self, result):
+		# The runner must finish before it's destroyed with the dialog; canceling it first keeps the wait short
+		if self.runner is not None:
+			self.runner.cancel()
+			self.runner.wait()
+		super().done(result)
+
+
+class SweepResultModel(QAbstractTableModel):
+	def __init__(self, result, dataset, parent=None):
+		super().__init__(parent)
+		self.result = result
+		self.headers = result.columns()
+		self.price_prefix = dataset.price_prefix
+		self.price_suffix = dataset.price_suffix
+
+	def rowCount(self, parent=QModelIndex()):
+		return 0 if parent.isValid() else len(self.result.rows)
+
+	def columnCount(self, parent=QModelIndex()):
+		return 0 if parent.isValid() else len(self.headers)
+
+	def headerData(self, section, orientation, role=Qt.DisplayRole):
+		if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+			return self.headers[section]
+		return None
+
+	def data(self, index, role=Qt.DisplayRole):
+		if not index.isValid() or role != Qt.DisplayRole:
+			return None
+		sheet_name, values, results = self.result.rows[index.row()]
+		column = index.column()
+		if column == 0:
+			return sheet_name
+		value = values[column - 1] if column <= len(values) else results[column - 1 - len(values)]
+		if type(value) is datasets.Price:
+			return f'{self.price_prefix}{value:.2f}{self.price_suffix}'
+		return str(export.cell(value))
+
+
 class SingleSheetView(QTabWidget):
 	valueChanged = Signal(str, str, object)
+	# Groups with more values than this are shown as a table instead of a widget per value
+	TABLE_THRESHOLD = 200
 
-	def __init__(self, sheet, price_prefix=None, price_suffix=None, parent=None):
+	def __init__(self, sheet, price_prefix=None, price_suffix=None, parent=None, table_threshold=None):
 		super().__init__(parent)
 		sheet = sheet or {}
-		for group_name, group_value in sheet.items():
-			tab = SingleGroupView(group_name, group_value, price_prefix, price_suffix)
-			self.addTab(tab, group_name)
-			tab.valueChanged.connect(lambda n, v, t=tab: self.valueChanged.emit(t.name, n, v))
+		self.price_prefix = price_prefix
+		self.price_suffix = price_suffix
+		self.table_threshold = self.TABLE_THRESHOLD if table_threshold is None else table_threshold
+		self.group_names = list(sheet)
+		# Group views are only built when their tab is first shown; until then, the group data they will show
+		self.group_views = [None] * len(self.group_names)
+		self.pending = list(sheet.values())
+		for group_name in self.group_names:
+			page = QWidget()
+			layout = QVBoxLayout()
+			layout.setContentsMargins(0, 0, 0, 0)
+			page.setLayout(layout)
+			self.addTab(page, group_name)
+		# The tab bar's signal still arrives when the signals of this widget are blocked
+		self.tabBar().currentChanged.connect(self.build_tab)
+		self.build_tab(self.currentIndex())
+
+	def build_tab(self, index):
+		if index < 0 or self.group_views[index] is not None:
+			return
+		group = self.pending[index]
+		view_type = GroupTableView if len(group) > self.table_threshold else SingleGroupView
+		view = view_type(self.group_names[index], group, self.price_prefix, self.price_suffix)
+		view.valueChanged.connect(lambda n, v: self.valueChanged.emit(view.name, n, v))
+		self.widget(index).layout().addWidget(view)
+		self.group_views[index] = view
+		self.pending[index] = None
 
 	def set_value(self, sheet):
 		# Assuming that the sheet has the same groups and order
 		for i, group_value in enumerate(sheet.values()):
-			self.widget(i).set_value(group_value)
+			if self.group_views[i] is None:
+				self.pending[i] = group_value
+			else:
+				self.group_views[i].set_value(group_value)
 
 
 class SingleGroupView(QWidget):
@@ -508,6 +1370,220 @@ class SingleGroupView(QWidget):
 			self.value_widgets[i].set_value(value)
 
 
+class GroupTableView(QTableView):
+	"""
+	Shows a group as a table with a row per value, for groups too large for SingleGroupView.
+	Only visible rows are painted, and editors are only created while a value is being edited.
+	"""
+	valueChanged = Signal(str, object)
+
+	def __init__(self, name, group, price_prefix=None, price_suffix=None, parent=None):
+		super().__init__(parent)
+		self.name = name
+		self.group_model = GroupTableModel(group, price_prefix, price_suffix, self)
+		self.setModel(self.group_model)
+		self.setItemDelegateForColumn(1, GroupValueDelegate(self))
+		self.verticalHeader().hide()
+		# With fixed row heights, the view doesn't need to measure every row
+		self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+		self.horizontalHeader().setStretchLastSection(True)
+		self.group_model.valueChanged.connect(self.valueChanged.emit)
+
+	def set_value(self, group):
+		self.group_model.set_group(group)
+
+
+class GroupTableModel(QAbstractTableModel):
+	valueChanged = Signal(str, object)
+	HEADERS = ('Name', 'Value')
+
+	def __init__(self, group, price_prefix=None, price_suffix=None, parent=None):
+		super().__init__(parent)
+		self.price_prefix = price_prefix or '$'
+		self.price_suffix = price_suffix or ''
+		self.names = list(group)
+		self.values = list(group.values())
+
+	def rowCount(self, parent=QModelIndex()):
+		return 0 if parent.isValid() else len(self.names)
+
+	def columnCount(self, parent=QModelIndex()):
+		return 0 if parent.isValid() else len(self.HEADERS)
+
+	def headerData(self, section, orientation, role=Qt.DisplayRole):
+		if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+			return self.HEADERS[section]
+		return None
+
+	def flags(self, index):
+		flags = super().flags(index)
+		if index.column() == 1:
+			flags |= Qt.ItemIsEditable
+		return flags
+
+	def data(self, index, role=Qt.DisplayRole):
+		# Editors get and set values through `values` and `set_row_value`, so only text is provided here
+		if not index.isValid() or role != Qt.DisplayRole:
+			return None
+		if index.column() == 0:
+			return self.names[index.row()]
+		return self.display_text(self.values[index.row()])
+
+	def display_text(self, value):
+		if type(value) is datasets.Price:
+			return f'{self.price_prefix}{value:.2f}{self.price_suffix}'
+		return str(export.cell(value))
+
+	def set_row_value(self, row, value):
+		if value == self.values[row]:
+			return
+		self.values[row] = value
+		index = self.index(row, 1)
+		self.dataChanged.emit(index, index)
+		self.valueChanged.emit(self.names[row], value)
+
+	def set_group(self, group):
+		names = list(group)
+		if names != self.names:
+			self.beginResetModel()
+			self.names = names
+			self.values = list(group.values())
+			self.endResetModel()
+		else:
+			# Keep the scroll position and selection when only values changed
+			self.values = list(group.values())
+			if self.values:
+				self.dataChanged.emit(self.index(0, 1), self.index(len(self.values) - 1, 1))
+
+
+class GroupValueDelegate(QStyledItemDelegate):
+	"""Edits values of a GroupTableModel with an editor matching the type of each value."""
+	def createEditor(self, parent, option, index):
+		value = index.model().values[index.row()]
+		# Not using isinstance for the same reasons as SingleGroupView
+		datatype = type(value)
+		if datatype is int:
+			editor = QSpinBox(parent)
+			editor.setMaximum(2**16)
+			editor.setMinimum(-(2**16-1))
+		elif datatype in (float, datasets.Price):
+			editor = QDoubleSpinBox(parent)
+			editor.setMaximum(2**16)
+			editor.setMinimum(-(2**16-1))
+			if datatype is datasets.Price:
+				editor.setPrefix(index.model().price_prefix)
+				editor.setSuffix(index.model().price_suffix)
+				editor.setDecimals(2)
+		elif datatype is datetime.date:
+			editor = QDateEdit(parent)
+			editor.setDisplayFormat('yyyy-MM-dd')
+			editor.setCalendarPopup(True)
+		elif datatype is datetime.time:
+			editor = QTimeEdit(parent)
+			editor.setDisplayFormat('HH:mm:ss')
+		elif datatype is datetime.datetime:
+			editor = QDateTimeEdit(parent)
+			editor.setDisplayFormat('yyyy-MM-dd HH:mm:ss')
+			editor.setCalendarPopup(True)
+		elif datatype is datasets.Timedelta:
+			editor = TimedeltaWidget(value.fmt, parent)
+			editor.layout().setContentsMargins(0, 0, 0, 0)
+		elif datatype is datasets.Calcdelta:
+			editor = CalcdeltaEditor(value.data_type, parent)
+		else:
+			editor = QLineEdit(parent)
+		editor.setAutoFillBackground(True)
+		return editor
+
+	def setEditorData(self, editor, index):
+		value = index.model().values[index.row()]
+		datatype = type(value)
+		if datatype in (int, float, datasets.Price):
+			editor.setValue(value)
+		elif datatype is datetime.date:
+			editor.setDate(QDate(value.year, value.month, value.day))
+		elif datatype is datetime.time:
+			editor.setTime(QTime(value.hour, value.minute, value.second))
+		elif datatype is datetime.datetime:
+			editor.setDateTime(QDateTime(
+				QDate(value.year, value.month, value.day),
+				QTime(value.hour, value.minute, value.second)
+			))
+		elif datatype in (datasets.Timedelta, datasets.Calcdelta):
+			editor.set_value(value)
+		else:
+			editor.setText(str(value))
+
+	def setModelData(self, editor, model, index):
+		datatype = type(model.values[index.row()])
+		if datatype in (int, float):
+			value = editor.value()
+		elif datatype is datasets.Price:
+			value = datasets.Price(editor.value())
+		elif datatype is datetime.date:
+			value = editor.date().toPython()
+		elif datatype is datetime.time:
+			value = editor.time().toPython()
+		elif datatype is datetime.datetime:
+			value = editor.dateTime().toPython()
+		elif datatype in (datasets.Timedelta, datasets.Calcdelta):
+			value = editor.get_value()
+		else:
+			value = editor.text()
+		model.set_row_value(index.row(), value)
+
+	def updateEditorGeometry(self, editor, option, index):
+		# Editors made of several widgets don't fit in a cell, so let them cover the cells next to it
+		rect = option.rect
+		hint = editor.sizeHint()
+		editor.setGeometry(rect.x(), rect.y(), max(rect.width(), hint.width()), max(rect.height(), hint.height()))
+
+
+class CalcdeltaEditor(QWidget):
+	EDIT_TYPES = {datetime.date: QDateEdit, datetime.time: QTimeEdit, datetime.datetime: QDateTimeEdit}
+
+	def __init__(self, data_type, parent=None):
+		super().__init__(parent)
+		self.data_type = data_type
+		self.start_edit = self.EDIT_TYPES[data_type]()
+		self.end_edit = self.EDIT_TYPES[data_type]()
+		layout = QHBoxLayout()
+		layout.setContentsMargins(0, 0, 0, 0)
+		for label, edit in (('Start:', self.start_edit), ('End:', self.end_edit)):
+			if data_type is not datetime.time:
+				edit.setCalendarPopup(True)
+			layout.addWidget(QLabel(label))
+			layout.addWidget(edit)
+		self.setLayout(layout)
+
+	def get_value(self):
+		start = self._get(self.start_edit)
+		# Like SingleCalcdeltaView, don't allow the end to be before the start
+		return datasets.Calcdelta(start, max(start, self._get(self.end_edit)))
+
+	def set_value(self, value):
+		self._set(self.start_edit, value.start)
+		self._set(self.end_edit, value.end)
+
+	def _get(self, edit):
+		if self.data_type is datetime.date:
+			return edit.date().toPython()
+		if self.data_type is datetime.time:
+			return edit.time().toPython()
+		return edit.dateTime().toPython()
+
+	def _set(self, edit, value):
+		if self.data_type is datetime.date:
+			edit.setDate(QDate(value.year, value.month, value.day))
+		elif self.data_type is datetime.time:
+			edit.setTime(QTime(value.hour, value.minute, value.second))
+		else:
+			edit.setDateTime(QDateTime(
+				QDate(value.year, value.month, value.day),
+				QTime(value.hour, value.minute, value.second)
+			))
+
+
 class SingleValueView(QWidget):
 	valueChanged = Signal(object)
 
@@ -0,0 +1,240 @@
+import bisect
+import collections
+import contextlib
+
+import datasets
+
+
+class History:
+	"""
+	Undo/redo history for changes to a dataset's sheets.
+
+	Changes made through this class are applied to the dataset and recorded as pairs of sheet snapshots
+	(before and after the change). Snapshots are `datasets.Sheet` copies, which share their groups with
+	the live sheet until it's edited, so each step only costs the groups that it changed.
+	Undoing or redoing puts copies of the snapshots back into the dataset.
+
+	When the estimated memory used by recorded steps exceeds `max_bytes`, the oldest ones are forgotten.
+	"""
+	# Rough cost of a step regardless of the data it keeps alive
+	STEP_OVERHEAD = 512
+
+	def __init__(self, dataset, max_bytes=16 * 2**20):
+		self.dataset = dataset
+		self.max_bytes = max_bytes
+		self.memory_usage = 0
+		self._undo = collections.deque()
+		self._redo = []
+		# Step collecting changes between begin() and commit()
+		self._open_step = None
+		self._open_depth = 0
+
+	def can_undo(self):
+		return bool(self._undo)
+
+	def can_redo(self):
+		return bool(self._redo)
+
+	def undo_description(self):
+		return self._undo[-1].description if self._undo else None
+
+	def redo_description(self):
+		return self._redo[-1].description if self._redo else None
+
+	def clear(self):
+		self._undo.clear()
+		self._redo.clear()
+		self.memory_usage = 0
+
+	def begin(self, description):
+		"""
+		Records all changes until the matching `commit` as a single step, in a single dataset transaction.
+		Calls can be nested.
+		"""
+		if self._open_step is None:
+			self._open_step = _Step(description, [], None, 0)
+		self._open_depth += 1
+		self.dataset.begin()
+
+	def commit(self):
+		"""Ends a step. Returns True if it was the outermost one and changed something, i.e. if it was recorded."""
+		self.dataset.commit()
+		self._open_depth -= 1
+		if self._open_depth:
+			return False
+		step, self._open_step = self._open_step, None
+		if step.changes:
+			self._record(step.description, step.changes)
+		return bool(step.changes)
+
+	@contextlib.contextmanager
+	def group(self, description):
+		self.begin(description)
+		try:
+			yield
+		finally:
+			self.commit()
+
+	def set_value(self, sheet_name, group_name, value_name, value):
+		before = self._state(sheet_name)
+		self.dataset.set_value(sheet_name, group_name, value_name, value)
+		after = self._state(sheet_name)
+		key = (sheet_name, group_name, value_name)
+		last = self._undo[-1] if self._undo else None
+		if self._open_step is None and last is not None and last.key == key and not self._redo:
+			# Consecutive edits of the same value (e.g. typing or spinning a number) are one step
+			self.memory_usage -= last.cost
+			last.changes[0] = (last.changes[0][0], after)
+			last.cost = self._cost(last.changes)
+			self.memory_usage += last.cost
+			self._evict()
+		else:
+			self._record(f'Edit {value_name}', [(before, after)], key=key)
+
+	def replace_sheet(self, name, sheet, description=None):
+		before = self._state(name)
+		self.dataset.replace_sheet(name, sheet)
+		self._record(description or f'Change {name}', [(before, self._state(name))])
+
+	def insert_sheet(self, name, sheet, index=None, special_format=None, description=None):
+		self.dataset.insert_sheet(name, sheet, index, special_format)
+		self._record(description or f'Add {name}', [(None, self._state(name, with_index=True))])
+
+	def remove_sheet(self, name):
+		before = self._state(name, with_index=True)
+		sheet = self.dataset.remove_sheet(name)
+		self._record(f'Delete {name}', [(before, None)])
+		return sheet
+
+	def rename_sheet(self, name, new_name):
+		before = self._state(name)
+		self.dataset.rename_sheet(name, new_name)
+		self._record(f'Rename {name}', [(before, self._state(new_name))])
+
+	def reorder_sheets(self, order, description='Reorder sheets'):
+		"""
+		Puts the sheets in `order`, a list of all their names. The fewest sheets possible are removed and inserted
+		again at their new positions, in one step, so that undoing puts them back.
+		"""
+		position = {name: i for i, name in enumerate(order)}
+		names = list(self.dataset.sheets)
+		kept = {names[i] for i in _increasing_subsequence([position[name] for name in names])}
+		moved = sorted((name for name in names if name not in kept), key=position.__getitem__)
+		if not moved:
+			return
+		with self.group(description):
+			sheets = {name: self.remove_sheet(name) for name in moved}
+			# The other sheets are in order already, so each inserted sheet finds all sheets before it in place
+			for name in moved:
+				self.insert_sheet(name, sheets[name], position[name])
+
+	def undo(self):
+		"""Reverts the last step and returns its description, or None if there is nothing to undo."""
+		if not self._undo:
+			return None
+		step = self._undo.pop()
+		with self.dataset.transaction():
+			for before, after in reversed(step.changes):
+				self._apply(after, before)
+		self._redo.append(step)
+		return step.description
+
+	def redo(self):
+		"""Reapplies the last undone step and returns its description, or None if there is nothing to redo."""
+		if not self._redo:
+			return None
+		step = self._redo.pop()
+		with self.dataset.transaction():
+			for before, after in step.changes:
+				self._apply(before, after)
+		self._undo.append(step)
+		return step.description
+
+	def _state(self, name, with_index=False):
+		# (name, index, sheet snapshot, special format) of a sheet as it is right now. Finding the index takes
+		# a pass over the sheets, so it's only done when the sheet is inserted or removed, as only then it's
+		# needed to put the sheet back; it's None otherwise.
+		sheet = self.dataset.get_sheet(name)
+		special_format = self.dataset.special_format if name == datasets.SPECIAL_SHEET else None
+		index = self.dataset.sheet_index(name) if with_index else None
+		return name, index, sheet.copy(), special_format
+
+	def _apply(self, current, target):
+		# Changes a sheet from the `current` state to the `target` state
+		if current is not None and target is not None:
+			if current[0] != target[0]:
+				self.dataset.rename_sheet(current[0], target[0])
+			self.dataset.replace_sheet(target[0], target[2].copy())
+		elif target is None:
+			self.dataset.remove_sheet(current[0])
+		else:
+			name, index, sheet, special_format = target
+			self.dataset.insert_sheet(name, sheet.copy(), index, special_format)
+
+	def _cost(self, changes):
+		cost = self.STEP_OVERHEAD
+		for before, after in changes:
+			# Count whichever side keeps more data alive that isn't shared with the other one
+			sides = []
+			for state, other in ((before, after), (after, before)):
+				if state is None:
+					sides.append(0)
+					continue
+				sheet = state[2]
+				sides.append(sum(
+					sheet.group_size(g) for g in sheet.unshared_groups(other[2] if other else None)
+				))
+			cost += max(sides)
+		return cost
+
+	def _record(self, description, changes, key=None):
+		if self._open_step is not None:
+			self._open_step.changes.extend(changes)
+			return
+		for step in self._redo:
+			self.memory_usage -= step.cost
+		self._redo.clear()
+		step = _Step(description, changes, key, self._cost(changes))
+		self._undo.append(step)
+		self.memory_usage += step.cost
+		self._evict()
+
+	def _evict(self):
+		# Always keep the most recent step, even if it alone exceeds the limit
+		while self.memory_usage > self.max_bytes and len(self._undo) > 1:
+			self.memory_usage -= self._undo.popleft().cost
+
+
+def _increasing_subsequence(values):
+	# Returns the indexes of a longest increasing subsequence of `values`, in O(n log n)
+	tail_values = []
+	# tails[k]: index of the smallest last value of the increasing subsequences of length k + 1 found so far
+	tails = []
+	previous = []
+	for i, value in enumerate(values):
+		k = bisect.bisect_left(tail_values, value)
+		previous.append(tails[k - 1] if k else None)
+		if k == len(tails):
+			tails.append(i)
+			tail_values.append(value)
+		else:
+			tails[k] = i
+			tail_values[k] = value
+	indexes = []
+	i = tails[-1] if tails else None
+	while i is not None:
+		indexes.append(i)
+		i = previous[i]
+	return indexes[::-1]
+
+
+class _Step:
+	__slots__ = ('description', 'changes', 'key', 'cost')
+
+	def __init__(self, description, changes, key, cost):
+		self.description = description
+		# List of (state before, state after) pairs, where a state is None if the sheet doesn't exist
+		self.changes = changes
+		# Identifies value edits that can be merged with the next one
+		self.key = key
+		self.cost = cost
@@ -0,0 +1,169 @@
+import csv
+import datetime
+import itertools
+
+import datasets
+import tracing
+
+
+# Rows read and converted at a time
+BATCH_SIZE = 1024
+
+
+def _calcdelta_cell(parse):
+	def parse_calcdelta(text):
+		parts = text.split(' - ')
+		if len(parts) != 2:
+			raise ValueError(f'Expected "start - end", got {text!r}')
+		return parse(parts)
+	return parse_calcdelta
+
+
+# Parsers from CSV cells (as written by `export.cell`) to values, by value type
+CELL_PARSERS = {
+	'text': datasets.VALUE_PARSERS['text'],
+	'int': int,
+	'float': float,
+	'date': datasets.parse_date,
+	'time': datasets.parse_time,
+	'datetime': datetime.datetime.fromisoformat,
+	'timedelta': datasets.parse_timedelta,
+	'calcdelta_d': _calcdelta_cell(datasets.VALUE_PARSERS['calcdelta_d']),
+	'calcdelta_t': _calcdelta_cell(datasets.VALUE_PARSERS['calcdelta_t']),
+	'calcdelta_dt': _calcdelta_cell(datasets.VALUE_PARSERS['calcdelta_dt'])
+}
+
+
+def _price_cell(dataset):
+	prefix, suffix = dataset.price_prefix, dataset.price_suffix
+
+	def parse_price(text):
+		text = text.strip()
+		if prefix and text.startswith(prefix):
+			text = text[len(prefix):]
+		if suffix and text.endswith(suffix):
+			text = text[:-len(suffix)]
+		return datasets.Price(text)
+	return parse_price
+
+
+def map_columns(dataset, header):
+	"""
+	Matches CSV columns named "group/value" (as written by `export`) to the dataset's format.
+	Returns a list of `(column index, group name, value name, parser)` tuples; other columns are ignored.
+	"""
+	columns = []
+	for i, column in enumerate(header):
+		group_name, _, value_name = column.partition('/')
+		value_type = dataset.format.get(group_name, {}).get(value_name)
+		if value_type is None:
+			continue
+		parse = _price_cell(dataset) if value_type == 'price' else CELL_PARSERS[value_type]
+		columns.append((i, group_name, value_name, parse))
+	return columns
+
+
+def _convert_batch(rows, columns, first_row):
+	# Converts the cells of one column at a time; empty cells become None
+	converted = []
+	for i, group_name, value_name, parse in columns:
+		values = []
+		for row_number, row in enumerate(rows, first_row):
+			text = row[i] if i < len(row) else ''
+			try:
+				values.append(parse(text) if text != '' else None)
+			except (ValueError, TypeError) as e:
+				raise ValueError(f'Row {row_number}, column {group_name}/{value_name}: {e}') from None
+		converted.append(values)
+	return converted
+
+
+def read_sheets(dataset, fp, sheet_column='sheet', group_by=None, batch_size=BATCH_SIZE):
+	"""
+	Reads a CSV file with a header row and yields `(name, sheet)` pairs, without adding them to the dataset.
+
+	Columns named "group/value" are converted according to the dataset's format; empty cells and values
+	without a column take the value of the dataset's default sheet. Each row becomes a sheet named after
+	its `sheet_column` cell, or "Imported N" if there is no such column. If `group_by` names a column,
+	all rows with the same value in it are merged into one sheet named after that value instead, with later
+	rows overriding the non-empty cells of earlier ones (e.g. one row per day merged into a weekly sheet);
+	those sheets are yielded once the whole file is read.
+	Rows are read and converted `batch_size` at a time, so memory use doesn't depend on the file size.
+	"""
+	reader = csv.reader(fp)
+	try:
+		header = next(reader)
+	except StopIteration:
+		return
+	columns = map_columns(dataset, header)
+	if not columns:
+		raise ValueError('No column matches a value of the dataset format (expected "group/value" column names)')
+	if group_by:
+		if group_by not in header:
+			raise ValueError(f'Column {group_by} not found')
+		name_column = header.index(group_by)
+	else:
+		name_column = header.index(sheet_column) if sheet_column in header else None
+	default = dataset.default
+	groups = {}
+	for _, group_name, value_name, _ in columns:
+		groups.setdefault(group_name, []).append(value_name)
+	merged = {}
+	counter = itertools.count(1)
+	first_row = 2
+	while True:
+		rows = list(itertools.islice(reader, batch_size))
+		if not rows:
+			break
+		converted = _convert_batch(rows, columns, first_row)
+		first_row += len(rows)
+		for row, values in zip(rows, zip(*converted)):
+			name = row[name_column] if name_column is not None and name_column < len(row) else ''
+			if not name:
+				name = f'Imported {next(counter)}'
+			if group_by and name in merged:
+				sheet = merged[name]
+			else:
+				sheet = default.copy()
+			cells = iter(values)
+			for group_name, value_names in groups.items():
+				group = dict(sheet[group_name])
+				for value_name in value_names:
+					value = next(cells)
+					if value is not None:
+						group[value_name] = value
+				sheet.set_group(group_name, group)
+			if group_by:
+				merged[name] = sheet
+			else:
+				yield name, sheet
+	yield from merged.items()
+
+
+def import_csv(dataset, path, history=None, **kwargs):
+	"""
+	Adds the sheets read from a CSV file (see `read_sheets`) to the end of the dataset and returns their names.
+	Names that already exist get a number appended. If `history` is given, sheets are added through it
+	as a single undoable step. Either way, the sheets are added in one dataset transaction.
+	Formula results aren't recomputed.
+	"""
+	with tracing.span('read CSV', path=str(path)), open(path, newline='') as f:
+		# Read everything before changing the dataset, so that a bad row doesn't leave a partial import
+		sheets = list(read_sheets(dataset, f, **kwargs))
+	names = []
+	with history.group(f'Import {len(sheets)} sheets') if history else dataset.transaction():
+		for name, sheet in sheets:
+			name = unique_name(dataset, name)
+			(history or dataset).insert_sheet(name, sheet)
+			names.append(name)
+	return names
+
+
+def unique_name(dataset, name):
+	reserved = (datasets.SPECIAL_SHEET, datasets.DEFAULT_SHEET)
+	if name not in reserved and not dataset.has_sheet(name):
+		return name
+	for i in itertools.count(2):
+		candidate = f'{name} ({i})'
+		if candidate not in reserved and not dataset.has_sheet(candidate):
+			return candidate
@@ -0,0 +1,272 @@
+import bisect
+import collections
+import datetime
+import re
+
+import datasets
+
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+	"""Makes text comparable regardless of case and whitespace."""
+	return ' '.join(text.casefold().split())
+
+
+def _in_dataset_order(dataset, names):
+	# Sorting a few names by position is cheaper than going through every sheet name, but not when there are many
+	if len(names) * 8 < len(dataset.sheets):
+		order = {name: i for i, name in enumerate(dataset.sheets)}
+		return sorted(names, key=order.__getitem__)
+	return [name for name in dataset.sheets if name in names]
+
+
+class TextIndex(datasets.DatasetListener):
+	"""
+	Inverted index from text values to the positions where they appear, as `(sheet, group, value name)` tuples.
+
+	Each value is indexed by its whole normalized text and, if `tokens` is True, by every word in it.
+	The index follows changes made through the dataset's methods, so it's built once and never rescanned.
+	The special sheet isn't indexed.
+	"""
+	def __init__(self, dataset, tokens=True):
+		self.dataset = dataset
+		self.tokens = tokens
+		# Normalized value or word -> set of positions
+		self._values = {}
+		self._words = {}
+		# Sorted keys of the above, for prefix searches
+		self._sorted_values = []
+		self._sorted_words = []
+		# Sheet name -> {(group, value name): normalized value}, to update positions when a sheet changes
+		self._sheet_values = {}
+		for name, sheet in dataset.sheets.items():
+			self.sheet_added(name, sheet)
+		dataset.add_listener(self)
+
+	def search(self, query, mode='value', group=None):
+		"""
+		Returns a set of positions of text values that match `query`:
+
+		- `mode='value'`: the whole value equals the query,
+		- `mode='word'`: the value contains every word of the query,
+		- `mode='prefix'`: the value or one of its words starts with the query.
+
+		Matching ignores case and extra whitespace. If `group` is given, only values in that group are returned.
+		"""
+		if mode == 'value':
+			positions = set(self._values.get(normalize(query), ()))
+		elif mode == 'word':
+			words = _WORD.findall(query.casefold())
+			if not words:
+				return set()
+			positions = set(self._words.get(words[0], ()))
+			for word in words[1:]:
+				positions &= self._words.get(word, set())
+		elif mode == 'prefix':
+			query = normalize(query)
+			positions = set()
+			for keys, index in ((self._sorted_values, self._values), (self._sorted_words, self._words)):
+				for key in keys[bisect.bisect_left(keys, query):]:
+					if not key.startswith(query):
+						break
+					positions |= index[key]
+		else:
+			raise ValueError(f'Unknown search mode: {mode}')
+		if group is not None:
+			positions = {p for p in positions if p[1] == group}
+		return positions
+
+	def sheets(self, query, mode='value', group=None):
+		"""Returns the names of sheets with values matching `query` (see `search`), in dataset order."""
+		found = {sheet for sheet, _, _ in self.search(query, mode, group)}
+		return _in_dataset_order(self.dataset, found)
+
+	def value_changed(self, sheet_name, group_name, value_name, old_value, new_value):
+		if sheet_name not in self._sheet_values:
+			return
+		position = (sheet_name, group_name, value_name)
+		if isinstance(old_value, str):
+			self._remove(position, self._sheet_values[sheet_name].pop((group_name, value_name)))
+		if isinstance(new_value, str):
+			text = normalize(new_value)
+			self._sheet_values[sheet_name][group_name, value_name] = text
+			self._add(position, text)
+
+	def sheet_added(self, name, sheet):
+		if name == datasets.SPECIAL_SHEET:
+			return
+		values = {}
+		for group_name, group in sheet.items():
+			for value_name, value in group.items():
+				if isinstance(value, str):
+					text = normalize(value)
+					values[group_name, value_name] = text
+					self._add((name, group_name, value_name), text)
+		self._sheet_values[name] = values
+
+	def sheet_removed(self, name, sheet):
+		for (group_name, value_name), text in self._sheet_values.pop(name, {}).items():
+			self._remove((name, group_name, value_name), text)
+
+	def sheet_renamed(self, name, new_name):
+		values = self._sheet_values.pop(name, {})
+		for (group_name, value_name), text in values.items():
+			self._remove((name, group_name, value_name), text)
+			self._add((new_name, group_name, value_name), text)
+		self._sheet_values[new_name] = values
+
+	def _keys(self, text):
+		yield self._values, self._sorted_values, text
+		if self.tokens:
+			for word in set(_WORD.findall(text)):
+				yield self._words, self._sorted_words, word
+
+	def _add(self, position, text):
+		if not text:
+			return
+		for index, sorted_keys, key in self._keys(text):
+			positions = index.get(key)
+			if positions is None:
+				positions = index[key] = set()
+				bisect.insort(sorted_keys, key)
+			positions.add(position)
+
+	def _remove(self, position, text):
+		if not text:
+			return
+		for index, sorted_keys, key in self._keys(text):
+			positions = index[key]
+			positions.discard(position)
+			if not positions:
+				del index[key]
+				del sorted_keys[bisect.bisect_left(sorted_keys, key)]
+
+
+def _interval(value):
+	"""Returns the `(start, end)` datetimes covered by a date, datetime, or date/datetime Calcdelta, or None."""
+	if isinstance(value, datasets.Calcdelta):
+		if not issubclass(value.data_type, datetime.date):
+			return None
+		start = _interval(min(value.start, value.end))
+		end = _interval(max(value.start, value.end))
+		return start[0], end[1]
+	if isinstance(value, datetime.datetime):
+		return value, value
+	if isinstance(value, datetime.date):
+		# A date covers the whole day
+		return datetime.datetime.combine(value, datetime.time.min), datetime.datetime.combine(value, datetime.time.max)
+	return None
+
+
+class TimeIndex(datasets.DatasetListener):
+	"""
+	Sorted index of the time spans covered by date, datetime, calcdelta_d and calcdelta_dt values.
+
+	Entries are kept sorted by start, so finding the values that start within a range is O(log n + k).
+	Overlap queries also look at values that start up to the longest stored span before the range,
+	which keeps them O(log n + k) as long as spans are short compared to the whole dataset (e.g. pay periods).
+	Dates cover the whole day. The index follows changes made through the dataset's methods.
+	The special sheet isn't indexed.
+	"""
+	def __init__(self, dataset):
+		self.dataset = dataset
+		# Sorted (start, end, sheet, group, value name) tuples
+		self._entries = []
+		# Sheet name -> {(group, value name): (start, end)}
+		self._sheet_entries = {}
+		# Span length -> number of entries with it, to know the longest span
+		self._spans = collections.Counter()
+		self._max_span = datetime.timedelta(0)
+		for name, sheet in dataset.sheets.items():
+			self._add_sheet(name, sheet, list.append)
+		# Inserting every entry in order would take quadratic time
+		self._entries.sort()
+		dataset.add_listener(self)
+
+	def search(self, start, end, mode='overlap', group=None):
+		"""
+		Returns the positions (`(sheet, group, value name)` tuples) of values that overlap the range
+		from `start` to `end` (inclusive), or with `mode='within'`, lie entirely within it.
+		`start` and `end` may be dates or datetimes; a date as the end includes the whole day.
+		"""
+		start = _interval(start)[0]
+		end = _interval(end)[1]
+		if mode == 'overlap':
+			if start - datetime.datetime.min > self._max_span:
+				first = bisect.bisect_left(self._entries, (start - self._max_span,))
+			else:
+				first = 0
+		elif mode == 'within':
+			first = bisect.bisect_left(self._entries, (start,))
+		else:
+			raise ValueError(f'Unknown time search mode: {mode}')
+		last = bisect.bisect_right(self._entries, (end, datetime.datetime.max))
+		positions = []
+		for entry_start, entry_end, sheet_name, group_name, value_name in self._entries[first:last]:
+			if entry_end < start or (mode == 'within' and entry_end > end):
+				continue
+			if group is None or group == group_name:
+				positions.append((sheet_name, group_name, value_name))
+		return positions
+
+	def sheets(self, start, end, mode='overlap', group=None):
+		"""Returns the names of sheets with values matching the range (see `search`), in dataset order."""
+		found = {sheet for sheet, _, _ in self.search(start, end, mode, group)}
+		return _in_dataset_order(self.dataset, found)
+
+	def value_changed(self, sheet_name, group_name, value_name, old_value, new_value):
+		if sheet_name not in self._sheet_entries:
+			return
+		entries = self._sheet_entries[sheet_name]
+		span = entries.pop((group_name, value_name), None)
+		if span is not None:
+			self._remove(span, sheet_name, group_name, value_name)
+		span = _interval(new_value)
+		if span is not None:
+			entries[group_name, value_name] = span
+			self._add(span, sheet_name, group_name, value_name)
+
+	def sheet_added(self, name, sheet):
+		self._add_sheet(name, sheet, bisect.insort)
+
+	def sheet_removed(self, name, sheet):
+		for (group_name, value_name), span in self._sheet_entries.pop(name, {}).items():
+			self._remove(span, name, group_name, value_name)
+
+	def sheet_renamed(self, name, new_name):
+		entries = self._sheet_entries.pop(name, {})
+		for (group_name, value_name), span in entries.items():
+			self._remove(span, name, group_name, value_name)
+			self._add(span, new_name, group_name, value_name)
+		self._sheet_entries[new_name] = entries
+
+	def _add_sheet(self, name, sheet, insert):
+		# `insert(entries, entry)` adds an entry to the sorted entries
+		if name == datasets.SPECIAL_SHEET:
+			return
+		entries = {}
+		for group_name, group in sheet.items():
+			for value_name, value in group.items():
+				span = _interval(value)
+				if span is not None:
+					entries[group_name, value_name] = span
+					self._add(span, name, group_name, value_name, insert=insert)
+		self._sheet_entries[name] = entries
+
+	def _add(self, span, *position, insert=bisect.insort):
+		insert(self._entries, (*span, *position))
+		length = span[1] - span[0]
+		self._spans[length] += 1
+		self._max_span = max(self._max_span, length)
+
+	def _remove(self, span, *position):
+		entry = (*span, *position)
+		del self._entries[bisect.bisect_left(self._entries, entry)]
+		length = span[1] - span[0]
+		self._spans[length] -= 1
+		if not self._spans[length]:
+			del self._spans[length]
+			if length == self._max_span:
+				self._max_span = max(self._spans, default=datetime.timedelta(0))
@@ -0,0 +1,163 @@
+"""
+Load test for the JSON-RPC service (service.py).
+
+Runs a number of concurrent clients that each send a mix of get_sheet, set_value, evaluate and
+batch_evaluate requests, then reports throughput and latency percentiles per method.
+
+By default, a service is started in this process with a synthetic dataset (see benchmarks.py);
+pass ``--connect HOST:PORT`` or ``--socket PATH`` to test a service that's already running,
+in which case ``--dataset`` must be a path the service can load.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+import service
+
+
+# Relative frequency of each request in the mix
+MIX = {'get_sheet': 40, 'set_value': 20, 'evaluate': 35, 'batch_evaluate': 5}
+BATCH_SIZE = 16
+
+
+class Client:
+	def __init__(self, reader, writer):
+		self.reader = reader
+		self.writer = writer
+		self._ids = itertools.count()
+
+	async def call(self, method, **params):
+		request_id = next(self._ids)
+		self.writer.write(json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}).encode() + b'\n')
+		await self.writer.drain()
+		# Requests are sent one at a time per client, so the next line is the response
+		response = json.loads(await self.reader.readline())
+		if 'error' in response:
+			raise RuntimeError(f'{method}: {response["error"]["message"]}')
+		return response['result']
+
+	def close(self):
+		self.writer.close()
+
+
+async def connect(args):
+	if args.socket:
+		return Client(*await asyncio.open_unix_connection(args.socket))
+	host, port = args.connect.rsplit(':', 1)
+	return Client(*await asyncio.open_connection(host, int(port)))
+
+
+async def run_client(args, info, rng, latencies):
+	client = await connect(args)
+	sheets = info['sheets']
+	int_values = [
+		(group_name, value_name)
+		for group_name, group_format in info['format'].items()
+		for value_name, value_type in group_format.items() if value_type == 'int'
+	]
+	methods = [m for m in MIX if m != 'set_value' or int_values]
+	weights = [MIX[m] for m in methods]
+	try:
+		for _ in range(args.requests):
+			method = rng.choices(methods, weights)[0]
+			if method == 'get_sheet':
+				params = {'sheet': rng.choice(sheets)}
+			elif method == 'set_value':
+				group_name, value_name = rng.choice(int_values)
+				params = {'sheet': rng.choice(sheets), 'group': group_name, 'name': value_name, 'value': rng.randrange(200)}
+			elif method == 'evaluate':
+				params = {'sheet': rng.choice(sheets)}
+			else:
+				params = {'sheets': rng.sample(sheets, min(BATCH_SIZE, len(sheets)))}
+			start = time.perf_counter()
+			await client.call(method, dataset=info['id'], **params)
+			latencies[method].append(time.perf_counter() - start)
+	finally:
+		client.close()
+
+
+async def run(args):
+	client = await connect(args)
+	try:
+		info = await client.call('load', path=args.dataset)
+	finally:
+		client.close()
+	latencies = collections.defaultdict(list)
+	rng = random.Random(args.seed)
+	start = time.perf_counter()
+	await asyncio.gather(*(
+		run_client(args, info, random.Random(rng.random()), latencies) for _ in range(args.clients)
+	))
+	return time.perf_counter() - start, latencies
+
+
+def percentile(sorted_values, p):
+	return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def report(elapsed, latencies):
+	total = sum(len(v) for v in latencies.values())
+	print(f'{total} requests in {elapsed:.2f} s ({total / elapsed:.0f} requests/s)')
+	print(f'  {"method":<16}{"count":>8}{"mean":>10}{"p50":>10}{"p90":>10}{"p99":>10}{"max":>10}')
+	everything = [t for values in latencies.values() for t in values]
+	for method, values in sorted(latencies.items()) + [('all', everything)]:
+		values = sorted(values)
+		columns = [statistics.mean(values)] + [percentile(values, p) for p in (50, 90, 99)] + [values[-1]]
+		print(f'  {method:<16}{len(values):>8}' + ''.join(f'{t * 1000:>8.2f}ms' for t in columns))
+
+
+def start_local_service(args):
+	"""Starts a service on a free port in a background thread and points `args` at it."""
+	ready = threading.Event()
+	state = {}
+
+	def on_ready(server):
+		state['port'] = server.sockets[0].getsockname()[1]
+		ready.set()
+
+	def serve():
+		asyncio.run(service.serve(port=0, ready=on_ready))
+
+	threading.Thread(target=serve, daemon=True).start()
+	ready.wait()
+	args.connect = f'127.0.0.1:{state["port"]}'
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--connect', metavar='HOST:PORT', help='test a running service over TCP')
+	parser.add_argument('--socket', metavar='PATH', help='test a running service over a Unix socket')
+	parser.add_argument('--dataset', help='dataset for the service to load (default: a synthetic one)')
+	parser.add_argument('--sheets', type=int, default=1000, help='sheets in the synthetic dataset')
+	parser.add_argument('--clients', type=int, default=16)
+	parser.add_argument('--requests', type=int, default=200, help='requests per client')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	temporary = None
+	if args.dataset is None:
+		import benchmarks
+
+		fd, temporary = tempfile.mkstemp(suffix='.json')
+		with os.fdopen(fd, 'w') as f:
+			json.dump(benchmarks.make_synthetic_data(args.sheets, args.seed), f)
+		args.dataset = temporary
+	try:
+		if not args.connect and not args.socket:
+			start_local_service(args)
+		report(*asyncio.run(run(args)))
+	finally:
+		if temporary:
+			os.remove(temporary)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,234 @@
+import asyncio
+import concurrent.futures
+import json
+from pathlib import Path
+
+import cache
+import datasets
+import tracing
+
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+# Sheets evaluated per executor task in batch_evaluate
+CHUNK_SIZE = 32
+# JSON types accepted by set_value for value types whose parsers take any value as it is
+JSON_TYPES = {'text': (str,), 'int': (int,), 'float': (int, float)}
+
+
+class RPCError(Exception):
+	def __init__(self, code, message):
+		super().__init__(message)
+		self.code = code
+
+
+class _ResponseEncoder(datasets.DatasetEncoder):
+	def default(self, o):
+		try:
+			return super().default(o)
+		except TypeError:
+			# Formula results can be anything
+			return str(o)
+
+
+class DatasetService:
+	"""
+	Service mode: keeps datasets loaded and answers JSON-RPC 2.0 requests about them,
+	so that several local tools can share one parsed dataset.
+
+	Requests and responses are JSON objects (or JSON-RPC batches), one per line, over TCP on localhost
+	or a Unix socket. Requests on a connection are handled concurrently, so responses may arrive out of order;
+	match them by `id`. Methods:
+
+	- `load(path)`: loads a dataset file and returns its `id` (the resolved path), name, format, sheet names and formulas.
+	  If the file is already loaded, the loaded dataset is kept, with the changes made to it, and described again.
+	- `get_sheet(sheet, dataset=None)`: returns a sheet's values as `{group: {value name: value}}`.
+	- `set_value(sheet, group, name, value, dataset=None)`: changes a value, given in the dataset file representation.
+	- `evaluate(sheet, dataset=None)`: returns the formula results for a sheet.
+	- `batch_evaluate(sheets=None, dataset=None)`: returns `{sheet: results}` for several (by default all) sheets.
+
+	`dataset` is the `id` returned by `load`, or by default, the most recently loaded dataset.
+	The special sheet is called `__special__`. Formulas are evaluated in a thread pool, so that the event loop
+	keeps answering other clients while they run.
+	"""
+	METHODS = ('load', 'get_sheet', 'set_value', 'evaluate', 'batch_evaluate')
+
+	def __init__(self, max_workers=None):
+		self.cache = cache.DatasetCache(snapshots=cache.SnapshotCache())
+		self.datasets = {}
+		self.last_loaded = None
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+	async def handle_connection(self, reader, writer):
+		write_lock = asyncio.Lock()
+		tasks = set()
+
+		async def respond(line):
+			response = await self.handle_message(line)
+			if response is None:
+				return
+			async with write_lock:
+				writer.write(response.encode() + b'\n')
+				await writer.drain()
+
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				if not line.strip():
+					continue
+				task = asyncio.ensure_future(respond(line))
+				tasks.add(task)
+				task.add_done_callback(tasks.discard)
+			if tasks:
+				await asyncio.gather(*tasks, return_exceptions=True)
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def handle_message(self, line):
+		"""Returns the encoded response to a request or batch, or None if nothing should be sent back."""
+		try:
+			message = json.loads(line)
+		except ValueError as e:
+			return json.dumps(_error(None, PARSE_ERROR, str(e)))
+		if isinstance(message, list):
+			if not message:
+				return json.dumps(_error(None, INVALID_REQUEST, 'Empty batch'))
+			responses = await asyncio.gather(*(self.handle_request(m) for m in message))
+			responses = [r for r in responses if r is not None]
+			return json.dumps(responses, cls=_ResponseEncoder) if responses else None
+		response = await self.handle_request(message)
+		return None if response is None else json.dumps(response, cls=_ResponseEncoder)
+
+	async def handle_request(self, request):
+		if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+			return _error(None, INVALID_REQUEST, 'Expected an object with a "method"')
+		request_id = request.get('id')
+		try:
+			if request['method'] not in self.METHODS:
+				raise RPCError(METHOD_NOT_FOUND, f'Unknown method: {request["method"]}')
+			method = getattr(self, request['method'])
+			params = request.get('params', {})
+			try:
+				# Requests run concurrently on the event loop thread, so their spans may overlap without nesting
+				with tracing.span(f'rpc {request["method"]}'):
+					if isinstance(params, list):
+						result = await method(*params)
+					else:
+						result = await method(**params)
+			except (KeyError, TypeError, ValueError) as e:
+				raise RPCError(INVALID_PARAMS, f'{type(e).__name__}: {e}') from e
+		except RPCError as e:
+			response = _error(request_id, e.code, str(e))
+		except Exception as e:
+			response = _error(request_id, SERVER_ERROR, f'{type(e).__name__}: {e}')
+		else:
+			response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+		# Requests without an id are notifications, which aren't answered
+		return response if 'id' in request else None
+
+	def get_dataset(self, dataset_id):
+		if dataset_id is None:
+			dataset_id = self.last_loaded
+		try:
+			return self.datasets[dataset_id]
+		except KeyError:
+			raise RPCError(INVALID_PARAMS, f'Dataset not loaded: {dataset_id}') from None
+
+	async def load(self, path):
+		dataset_id = str(Path(path).resolve())
+		if dataset_id not in self.datasets:
+			loop = asyncio.get_running_loop()
+			dataset = await loop.run_in_executor(self.executor, _load_dataset, self.cache, dataset_id)
+			# Another request may have loaded the same file in the meantime
+			self.datasets.setdefault(dataset_id, dataset)
+		dataset = self.datasets[dataset_id]
+		self.last_loaded = dataset_id
+		return {
+			'id': dataset_id,
+			'name': dataset.name,
+			'sheets': list(dataset.sheets),
+			'format': dataset.format,
+			'special': dataset.special is not None,
+			'formulas': list(dataset.formulas)
+		}
+
+	async def get_sheet(self, sheet, dataset=None):
+		return {
+			group_name: dict(group)
+			for group_name, group in self.get_dataset(dataset).get_sheet(sheet).items()
+		}
+
+	async def set_value(self, sheet, group, name, value, dataset=None):
+		dataset = self.get_dataset(dataset)
+		format_spec = dataset.special_format if sheet == datasets.SPECIAL_SHEET else dataset.format
+		value_type = format_spec[group][name]
+		# bool is an int in Python, but not a number in JSON
+		if isinstance(value, bool) or not isinstance(value, JSON_TYPES.get(value_type, object)):
+			raise RPCError(INVALID_PARAMS, f'{group}/{name} has the type {value_type}, which {json.dumps(value)} isn\'t')
+		dataset.set_value(sheet, group, name, datasets.VALUE_PARSERS[value_type](value))
+		return True
+
+	async def evaluate(self, sheet, dataset=None):
+		dataset = self.get_dataset(dataset)
+		current = dataset.get_sheet(sheet)
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, dataset.evaluate, current)
+
+	async def batch_evaluate(self, sheets=None, dataset=None):
+		dataset = self.get_dataset(dataset)
+		if sheets is None:
+			sheets = list(dataset.sheets)
+		current = [dataset.get_sheet(name) for name in sheets]
+		loop = asyncio.get_running_loop()
+		chunks = await asyncio.gather(*(
+			loop.run_in_executor(self.executor, _evaluate_chunk, dataset, current[i:i + CHUNK_SIZE])
+			for i in range(0, len(current), CHUNK_SIZE)
+		))
+		return dict(zip(sheets, (results for chunk in chunks for results in chunk)))
+
+
+def _load_dataset(dataset_cache, path):
+	dataset = dataset_cache.load(path)
+	# Formulas may search the indexes from any executor thread, so they're built here, before other requests
+	# can see the dataset; afterwards, they follow edits made on the event loop thread
+	dataset.text_index
+	dataset.time_index
+	return dataset
+
+
+def _evaluate_chunk(dataset, sheets):
+	return [dataset.evaluate(sheet) for sheet in sheets]
+
+
+def _error(request_id, code, message):
+	return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+async def serve(host='127.0.0.1', port=8765, socket_path=None, preload=(), max_workers=None, ready=None):
+	"""
+	Runs the service until cancelled. If `socket_path` is given, listens on a Unix socket instead of TCP.
+	`preload` is a list of dataset files to load before accepting connections.
+	`ready`, if given, is called with the server once it's listening.
+	"""
+	service = DatasetService(max_workers)
+	for path in preload:
+		await service.load(path)
+	if socket_path:
+		server = await asyncio.start_unix_server(service.handle_connection, socket_path)
+	else:
+		server = await asyncio.start_server(service.handle_connection, host, port)
+	if ready is not None:
+		ready(server)
+	try:
+		async with server:
+			await server.serve_forever()
+	finally:
+		service.executor.shutdown(wait=False)
@@ -0,0 +1,261 @@
+import collections.abc
+import datetime
+import json
+import os
+from pathlib import Path
+
+import compression
+import datasets
+import tracing
+
+
+SHARD_BY = ('count', 'year', 'month')
+DEFAULT_SHARD_SIZE = 100
+# Shard key of sheets without any date, when sharding by date
+UNDATED = 'undated'
+
+
+def is_manifest(data):
+	"""Returns True if raw dataset data (as loaded from JSON) is the manifest of a sharded dataset."""
+	return 'shards' in data
+
+
+def is_sharded(dataset):
+	return isinstance(dataset.sheets, ShardedSheets)
+
+
+def shard_directory(manifest_path):
+	"""Returns the directory holding the shards of a manifest, e.g. `Work.shards` for `Work.json`."""
+	manifest_path = Path(manifest_path)
+	return manifest_path.with_name(f'{manifest_path.stem}.shards')
+
+
+def date_key(sheet, by):
+	"""Returns the year ("2023") or month ("2023-05") of the first date in a sheet, or `UNDATED`."""
+	for group in sheet.values():
+		for value in group.values():
+			if isinstance(value, datasets.Calcdelta) and issubclass(value.data_type, datetime.date):
+				value = value.start
+			if isinstance(value, datetime.date):
+				return f'{value.year:04}' if by == 'year' else f'{value.year:04}-{value.month:02}'
+	return UNDATED
+
+
+class _Shard:
+	__slots__ = ('file', 'names', 'loaded', 'dirty')
+
+	def __init__(self, file, names, loaded=False, dirty=False):
+		self.file = file
+		self.names = names
+		# Whether the sheets of this shard were read from its file
+		self.loaded = loaded
+		# Whether sheets were added to or removed from this shard since it was saved
+		self.dirty = dirty
+
+	def copy(self):
+		return _Shard(self.file, list(self.names), self.loaded, self.dirty)
+
+
+class ShardedSheets(collections.abc.MutableMapping):
+	"""
+	The sheets of a sharded dataset, used as its `Dataset.sheets`. Sheets are spread across shard files
+	in `directory` and a shard is read when one of its sheets is first accessed, so iterating over names
+	doesn't read anything but iterating over sheets reads every shard.
+
+	New sheets go to the last shard with less than `size` sheets (`by='count'`), or to the shard of the year
+	or month of their first date (`by='year'` or `by='month'`). A shard needs to be written again when
+	sheets were added to or removed from it, or when one of its sheets no longer shares all of its groups
+	with the copy kept from when it was read or saved; sheets are copied on write, so that's cheap to check.
+	"""
+	def __init__(self, directory, converters, schema, by='count', size=DEFAULT_SHARD_SIZE, shards=(), order=None):
+		self.directory = Path(directory) if directory else None
+		self.by = by
+		self.size = size
+		self._converters = converters
+		self._schema = schema
+		self._shards = {shard.file: shard for shard in shards}
+		# Sheet name -> shard file, in sheet order
+		shard_of = {name: shard.file for shard in shards for name in shard.names}
+		self._shard_of = {name: shard_of[name] for name in order} if order is not None else shard_of
+		self._sheets = {}
+		# Copies of sheets as they were read or last saved
+		self._saved = {}
+
+	def __getitem__(self, name):
+		sheet = self._sheets.get(name)
+		if sheet is None:
+			self._load(self._shards[self._shard_of[name]])
+			sheet = self._sheets[name]
+		return sheet
+
+	def __setitem__(self, name, sheet):
+		if name not in self._shard_of:
+			shard = self._shard_for(sheet)
+			shard.names.append(name)
+			shard.dirty = True
+			self._shard_of[name] = shard.file
+		self._sheets[name] = sheet
+
+	def __delitem__(self, name):
+		shard = self._shards[self._shard_of.pop(name)]
+		shard.names.remove(name)
+		shard.dirty = True
+		self._sheets.pop(name, None)
+		self._saved.pop(name, None)
+
+	def __iter__(self):
+		return iter(self._shard_of)
+
+	def __len__(self):
+		return len(self._shard_of)
+
+	def __contains__(self, name):
+		# Don't read a shard just to check a name
+		return name in self._shard_of
+
+	def insert(self, index, name, sheet):
+		"""Adds a sheet at a position in the sheet order."""
+		self[name] = sheet
+		items = list(self._shard_of.items())
+		items.insert(index, items.pop())
+		self._shard_of = dict(items)
+
+	def rename(self, name, new_name):
+		"""Renames a sheet, keeping its position and shard. The shard is read first, as its file has the old name."""
+		file = self._shard_of[name]
+		shard = self._shards[file]
+		if name not in self._sheets:
+			self._load(shard)
+		self._shard_of = {new_name if k == name else k: v for k, v in self._shard_of.items()}
+		shard.names[shard.names.index(name)] = new_name
+		shard.dirty = True
+		if name in self._sheets:
+			self._sheets[new_name] = self._sheets.pop(name)
+		if name in self._saved:
+			self._saved[new_name] = self._saved.pop(name)
+
+	def copy(self):
+		"""Returns a copy with copies of the loaded sheets; shards that aren't loaded yet are read separately."""
+		sheets = ShardedSheets(self.directory, self._converters, self._schema, self.by, self.size)
+		sheets._shards = {file: shard.copy() for file, shard in self._shards.items()}
+		sheets._shard_of = dict(self._shard_of)
+		sheets._sheets = {name: sheet.copy() for name, sheet in self._sheets.items()}
+		sheets._saved = dict(self._saved)
+		return sheets
+
+	def shards(self):
+		"""Returns the `(file name, sheet names)` of every shard."""
+		return [(shard.file, list(shard.names)) for shard in self._shards.values()]
+
+	def save(self, directory):
+		"""
+		Writes the shards that changed to `directory` and deletes the files of shards left empty.
+		If `directory` isn't where the shards were read from, every shard is written.
+		"""
+		directory = Path(directory)
+		everything = directory != self.directory
+		directory.mkdir(parents=True, exist_ok=True)
+		for shard in list(self._shards.values()):
+			if not (everything or self._is_dirty(shard)):
+				continue
+			if not shard.names:
+				(directory / shard.file).unlink(missing_ok=True)
+				del self._shards[shard.file]
+				continue
+			if not shard.loaded and self.directory is not None:
+				self._load(shard)
+			with tracing.span('write shard', file=shard.file, sheets=len(shard.names)):
+				raw = {name: datasets.Dataset.remove_format_from_sheet(self._sheets[name]) for name in shard.names}
+				_write_json(directory / shard.file, {'sheets': raw})
+			shard.dirty = False
+			shard.loaded = True
+			for name in shard.names:
+				self._saved[name] = self._sheets[name].copy()
+		self.directory = directory
+
+	def _is_dirty(self, shard):
+		if shard.dirty:
+			return True
+		for name in shard.names:
+			sheet = self._sheets.get(name)
+			if sheet is not None and (name not in self._saved or sheet.unshared_groups(self._saved[name])):
+				return True
+		return False
+
+	def _load(self, shard):
+		with tracing.span('load shard', file=shard.file), open(self.directory / shard.file, 'rb') as f:
+			raw = json.load(f)['sheets']
+			for name in shard.names:
+				# Sheets that were replaced before their shard was read are newer than the file
+				if name not in self._sheets:
+					sheet = datasets.decode_sheet(raw[name], self._converters, self._schema)
+					self._sheets[name] = sheet
+					self._saved[name] = sheet.copy()
+		shard.loaded = True
+
+	def _shard_for(self, sheet):
+		if self.by == 'count':
+			shards = list(self._shards.values())
+			if shards and len(shards[-1].names) < self.size:
+				return shards[-1]
+			file = f'{len(shards) + 1:04}.json'
+			while file in self._shards:
+				file = f'{int(file[:-5]) + 1:04}.json'
+		else:
+			file = f'{date_key(sheet, self.by)}.json'
+			if file in self._shards:
+				return self._shards[file]
+		# A new shard has nothing on disk to read
+		shard = self._shards[file] = _Shard(file, [], loaded=True, dirty=True)
+		return shard
+
+
+def from_manifest(data, path):
+	"""Creates a Dataset from the raw data of a manifest at `path`; sheets are read from its shards when needed."""
+	shard_info = data['shards']
+	dataset = datasets.Dataset(data)
+	dataset.sheets = ShardedSheets(
+		shard_directory(path), datasets.compile_converters(dataset.format), dataset.schema,
+		shard_info.get('by', 'count'), shard_info.get('size', DEFAULT_SHARD_SIZE),
+		[_Shard(file, list(names)) for file, names in shard_info['files'].items()],
+		data.get('order')
+	)
+	return dataset
+
+
+@tracing.traced('save sharded dataset')
+def save(dataset, path):
+	"""Writes a sharded dataset to the manifest `path`, only rewriting the shards that changed."""
+	sheets = dataset.sheets
+	sheets.save(shard_directory(path))
+	manifest = dataset.header_data()
+	# Only the reserved sheets are kept in the manifest itself
+	manifest['sheets'] = {}
+	if dataset.special:
+		manifest['sheets'][datasets.SPECIAL_SHEET] = datasets.Dataset.remove_format_from_sheet(dataset.special)
+	if datasets.DEFAULT_SHEET in dataset._data['sheets']:
+		manifest['sheets'][datasets.DEFAULT_SHEET] = datasets.Dataset.remove_format_from_sheet(dataset.default)
+	manifest['order'] = list(sheets)
+	manifest['shards'] = {'by': sheets.by, 'size': sheets.size, 'files': dict(sheets.shards())}
+	# The manifest is written last, so it never lists shards that weren't written yet
+	_write_json(path, manifest, indent=4)
+
+
+def split(dataset, path, by='count', size=DEFAULT_SHARD_SIZE):
+	"""Writes a copy of a regular dataset as a sharded dataset with the manifest `path`."""
+	if by not in SHARD_BY:
+		raise ValueError(f'Unknown sharding: {by} (expected one of {", ".join(SHARD_BY)})')
+	sharded = dataset.copy()
+	sharded.sheets = ShardedSheets(None, datasets.compile_converters(dataset.format), dataset.schema, by, size)
+	for name, sheet in dataset.sheets.items():
+		sharded.sheets[name] = sheet.copy()
+	save(sharded, path)
+
+
+def _write_json(path, data, indent=None):
+	# Write to a temporary file first, so that a failed write doesn't destroy the previous version
+	temporary = Path(path).with_name(f'.{Path(path).name}.tmp')
+	# The manifest may be compressed, like a regular dataset file
+	with compression.open_file(temporary, 'w', like=path) as f:
+		json.dump(data, f, cls=datasets.DatasetEncoder, indent=indent)
+	os.replace(temporary, path)
@@ -0,0 +1,212 @@
+import ast
+import csv
+import functools
+import itertools
+import math
+
+import datasets
+import export
+import importer
+import sharding
+import tracing
+
+
+# Largest number of (sheet, combination) pairs a sweep may evaluate
+MAX_EVALUATIONS = 1_000_000
+# Evaluations per task when using worker processes
+CHUNK_SIZE = 256
+NUMERIC_TYPES = ('int', 'float', 'price')
+
+
+class SweepResult:
+	"""
+	The results of a sweep: one row per sheet and combination of parameter values, in sheet order and then
+	in the order of `itertools.product` over the parameter values.
+	"""
+	def __init__(self, parameters, labels, rows):
+		# (group name, value name) of every parameter
+		self.parameters = parameters
+		# Formula labels, in the order of the results in each row
+		self.labels = labels
+		# (sheet name, tuple of parameter values, tuple of results)
+		self.rows = rows
+
+	def columns(self):
+		"""Returns the column names of `iter_rows`: the sheet name, every parameter as "group/value", and every formula."""
+		return ['sheet'] + [f'{group_name}/{value_name}' for group_name, value_name in self.parameters] + self.labels
+
+	def iter_rows(self):
+		"""Yields every row as a flat list of plain values, like `export.iter_rows`."""
+		for sheet_name, values, results in self.rows:
+			yield [sheet_name] + [export.cell(value) for value in values] + [export.cell(result) for result in results]
+
+	def write_csv(self, fp):
+		writer = csv.writer(fp)
+		writer.writerow(self.columns())
+		writer.writerows(self.iter_rows())
+
+
+def _constant_key(subscript):
+	key = subscript.slice
+	if isinstance(key, ast.Constant) and isinstance(key.value, str):
+		return key.value
+	return None
+
+
+@functools.lru_cache(maxsize=1024)
+def formula_dependencies(formula):
+	"""
+	Returns what a formula reads from the special sheet and from the results of other formulas, as a
+	`(special values, result labels)` pair. Special values are `(group name, value name)` pairs, where the value
+	name is None if the formula reads values of the group that aren't known in advance. Either part is None
+	if the formula uses `special` or `results` in any other way, e.g. by passing them to a function.
+	"""
+	try:
+		tree = ast.parse(formula, mode='eval')
+	except SyntaxError:
+		return None, None
+	parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+	special_reads = set()
+	result_reads = set()
+	for node in ast.walk(tree):
+		if not isinstance(node, ast.Name) or node.id not in ('special', 'results'):
+			continue
+		parent = parents.get(node)
+		key = _constant_key(parent) if isinstance(parent, ast.Subscript) and parent.value is node else None
+		if node.id == 'results':
+			if key is None:
+				result_reads = None
+			elif result_reads is not None:
+				result_reads.add(key)
+			continue
+		if key is None:
+			special_reads = None
+			continue
+		grandparent = parents.get(parent)
+		value_name = None
+		if isinstance(grandparent, ast.Subscript) and grandparent.value is parent:
+			value_name = _constant_key(grandparent)
+		if special_reads is not None:
+			special_reads.add((key, value_name))
+	return special_reads, result_reads
+
+
+def dependent_formulas(formulas, parameters):
+	"""
+	Returns the labels of the formulas whose results may change when the special values `parameters`
+	(`(group name, value name)` pairs) change, directly or through the results of other formulas.
+	The other formulas only need to be evaluated once per sheet.
+	"""
+	dependent = set()
+	for label, formula in formulas.items():
+		special_reads, result_reads = formula_dependencies(formula)
+		if (
+			special_reads is None
+			or any((g, v) in special_reads or (g, None) in special_reads for g, v in parameters)
+			or (result_reads is None and dependent)
+			or (result_reads is not None and not result_reads.isdisjoint(dependent))
+		):
+			dependent.add(label)
+	return dependent
+
+
+def parse_values(text, value_type):
+	"""
+	Parses the values of a parameter from a comma-separated list, e.g. "15, 16.5, 18". Values are written like
+	exported cells (see `export.cell`). For numbers, an item can also be a range "start:stop:step" that includes
+	`stop`, e.g. "15:20:0.5".
+	"""
+	parse = datasets.Price if value_type == 'price' else importer.CELL_PARSERS[value_type]
+	values = []
+	for item in text.split(','):
+		item = item.strip()
+		if not item:
+			continue
+		if value_type in NUMERIC_TYPES and item.count(':') == 2:
+			start, stop, step = (parse(part.strip()) for part in item.split(':'))
+			if step <= 0:
+				raise ValueError(f'The step of {item} must be positive')
+			# Tolerate rounding errors of fractional steps
+			count = math.floor((stop - start) / step + 1e-9) + 1
+			values.extend(parse(round(start + i * step, 10)) for i in range(count))
+		else:
+			values.append(parse(item))
+	if not values:
+		raise ValueError('No values given')
+	return values
+
+
+def sweep(dataset, parameters, sheet_names=None, workers=0, mp_context=None, progress=None):
+	"""
+	Evaluates the formulas of a dataset for every combination of the given special values and returns
+	a `SweepResult`. `parameters` maps `(group name, value name)` pairs of the special sheet to lists of
+	values to try. If `sheet_names` isn't given, every sheet is evaluated.
+
+	Formulas that don't depend on the parameters (see `dependent_formulas`) are evaluated once per sheet, and only
+	the others once per combination. If `workers` is more than 0, evaluations are spread over that many processes,
+	started with `mp_context` if given, except for sharded datasets, which can't be sent to other processes.
+
+	If given, `progress(evaluations done, total evaluations)` is called every `CHUNK_SIZE` evaluations.
+	An exception raised by it stops the sweep, and evaluations that haven't started yet are canceled.
+	"""
+	parameters = dict(parameters)
+	if dataset.special is None:
+		raise ValueError('The dataset has no special sheet')
+	for group_name, value_name in parameters:
+		if value_name not in dataset.special_format.get(group_name, {}):
+			raise ValueError(f'{group_name}/{value_name} is not a value of the special sheet')
+	if sheet_names is None:
+		sheet_names = list(dataset.sheets)
+	combinations = list(itertools.product(*parameters.values()))
+	if len(combinations) * len(sheet_names) > MAX_EVALUATIONS:
+		raise ValueError(
+			f'{len(combinations)} combinations for {len(sheet_names)} sheets are more than {MAX_EVALUATIONS} evaluations'
+		)
+	names = list(parameters)
+	labels = dependent_formulas(dataset.formulas, names)
+	tasks = [(sheet_name, values) for sheet_name in sheet_names for values in combinations]
+	with tracing.span('sweep', evaluations=len(tasks), formulas=len(labels), workers=workers):
+		if workers > 0 and not sharding.is_sharded(dataset):
+			with export.worker_pool(dataset, workers, mp_context) as executor:
+				futures = [
+					executor.submit(_evaluate_chunk, tasks[i:i + CHUNK_SIZE], names, labels)
+					for i in range(0, len(tasks), CHUNK_SIZE)
+				]
+				try:
+					results = []
+					for future in futures:
+						results.extend(future.result())
+						if progress is not None:
+							progress(len(results), len(tasks))
+				except BaseException:
+					# Otherwise, leaving the pool would wait for every remaining chunk
+					for future in futures:
+						future.cancel()
+					raise
+		else:
+			results = _evaluate(dataset, tasks, names, labels, progress)
+	rows = [(sheet_name, values, row) for (sheet_name, values), row in zip(tasks, results)]
+	return SweepResult(names, list(dataset.formulas), rows)
+
+
+def _evaluate(dataset, tasks, names, labels, progress=None):
+	rows = []
+	base_name = base = None
+	every_formula = len(labels) == len(dataset.formulas)
+	for sheet_name, values in tasks:
+		sheet = dataset.sheets[sheet_name]
+		if sheet_name != base_name and not every_formula:
+			# Results of the formulas that don't depend on the parameters
+			base_name, base = sheet_name, dataset.evaluate(sheet)
+		special = dataset.special.copy()
+		for (group_name, value_name), value in zip(names, values):
+			special.set_value(group_name, value_name, value)
+		results = dataset.evaluate(sheet, special, None if every_formula else labels, base)
+		rows.append(tuple(results[label] for label in dataset.formulas))
+		if progress is not None and len(rows) % CHUNK_SIZE == 0:
+			progress(len(rows), len(tasks))
+	return rows
+
+
+def _evaluate_chunk(tasks, names, labels):
+	return _evaluate(export.worker_dataset(), tasks, names, labels)
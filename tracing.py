@@ -0,0 +1,116 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+# If set, tracing starts when the program starts, and the trace is written to this path at exit
+ENV_VAR = 'DATASHEETCALCULATOR_TRACE'
+
+# Recorded trace events while tracing is enabled, otherwise None
+_events = None
+_start_ns = 0
+_thread_names = {}
+_NO_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+	__slots__ = ('name', 'args', 'start')
+
+	def __init__(self, name, args):
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = time.perf_counter_ns()
+		return self
+
+	def __exit__(self, *exc_info):
+		end = time.perf_counter_ns()
+		events = _events
+		if events is None:
+			# Tracing was stopped in the meantime
+			return
+		tid = threading.get_native_id()
+		if tid not in _thread_names:
+			_thread_names[tid] = threading.current_thread().name
+		event = {
+			'name': self.name, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+			'ts': (self.start - _start_ns) / 1000, 'dur': (end - self.start) / 1000
+		}
+		if self.args:
+			event['args'] = self.args
+		# list.append is atomic, so spans can end in any thread
+		events.append(event)
+
+
+def enabled():
+	return _events is not None
+
+
+def start(path=None):
+	"""
+	Starts recording spans. If `path` is given, the trace is written there when the program exits.
+	Starting again discards what was recorded so far.
+	"""
+	global _events, _start_ns
+	_thread_names.clear()
+	_start_ns = time.perf_counter_ns()
+	_events = []
+	if path:
+		atexit.register(dump, path)
+
+
+def stop():
+	"""Stops recording and returns the recorded trace events."""
+	global _events
+	events, _events = _events, None
+	return events or []
+
+
+def span(name, **args):
+	"""
+	Returns a context manager that records the time spent in its block as a span named `name`,
+	with `args` shown as its details. Spans nest within the same thread.
+	When tracing isn't enabled, this returns a shared do-nothing context manager.
+	"""
+	if _events is None:
+		return _NO_SPAN
+	return _Span(name, args)
+
+
+def traced(name=None):
+	"""Decorator recording every call of a function as a span, named `name` or after the function."""
+	def decorator(func):
+		span_name = name or func.__qualname__
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if _events is None:
+				return func(*args, **kwargs)
+			with _Span(span_name, None):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def dump(path):
+	"""
+	Writes the spans recorded so far to `path` in the Chrome trace event format, which can be opened in
+	Perfetto (ui.perfetto.dev) or chrome://tracing. Tracing continues afterwards.
+	"""
+	events = list(_events or ())
+	pid = os.getpid()
+	metadata = [
+		{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+		for tid, thread_name in list(_thread_names.items())
+	]
+	with open(path, 'w') as f:
+		json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+
+
+if os.environ.get(ENV_VAR):
+	start(os.environ[ENV_VAR])